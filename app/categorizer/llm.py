@@ -1,8 +1,8 @@
 import os
 from typing import Dict, List
 
-from app.media.llm_client import ollama_generate
-from app.media.json_utils import extract_json_object
+from app.media.llm_client import LLMOutputError, ollama_generate_json
+from app.media.llm_schemas import CategoryOut, category_schema
 
 
 SYSTEM = """You are an expert chef and culinary taxonomy assistant.
@@ -58,13 +58,20 @@ Output schema (STRICT JSON):
 }}
 """
 
-    raw = ollama_generate(system=SYSTEM, prompt=prompt, timeout_s=int(os.getenv("CATEGORY_LLM_TIMEOUT_S", "180")))
-    parsed = extract_json_object(raw)
-    if isinstance(parsed, dict):
-        cats = _safe_categories(parsed.get("categories"))
-    elif isinstance(parsed, list):
-        cats = _safe_categories(parsed)
-    else:
+    def _check(out: CategoryOut) -> None:
+        if not set(_safe_categories(out.categories)) & set(allowed_categories):
+            raise ValueError(f"categories must be chosen from {allowed_categories}")
+
+    try:
+        parsed = ollama_generate_json(
+            SYSTEM, prompt, CategoryOut,
+            schema=category_schema(allowed_categories),
+            check=_check,
+            timeout_s=int(os.getenv("CATEGORY_LLM_TIMEOUT_S", "180")),
+        )
+        cats = _safe_categories(parsed.categories)
+    except LLMOutputError:
+        # caller falls back to the best heuristic score
         cats = []
 
     allowed_set = set(allowed_categories)
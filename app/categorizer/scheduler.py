@@ -2,34 +2,35 @@ import os
 import time
 from typing import List
 
+from rq import Queue
+
 from app.categorizer.db import fetch_pending_recipe_ids
-from app.queue import get_category_queue, claim_category_recipe, clear_category_claim
+from app.queue import get_category_queue, claim_category_recipes, clear_category_claims
 
 
 def _enqueue_batch(recipe_ids: List[int]) -> int:
     q = get_category_queue()
-    queued = 0
-    for rid in recipe_ids:
-        rid = int(rid)
-        # Avoid duplicate enqueue while a recipe is in-flight
-        if not claim_category_recipe(rid):
-            continue
-
-        job_id = f"recipe-category-{rid}"
-        try:
-            q.enqueue(
+    # Avoid duplicate enqueue while a recipe is in-flight (one pipelined SET NX for the batch)
+    claimed = claim_category_recipes(recipe_ids)
+    if not claimed:
+        return 0
+    try:
+        q.enqueue_many([
+            Queue.prepare_data(
                 "app.categorizer.tasks.process_recipe_category_job",
-                rid,
-                job_id=job_id,
-                job_timeout=os.getenv("CATEGORY_JOB_TIMEOUT", "20m"),
+                (rid,),
+                job_id=f"recipe-category-{rid}",
+                timeout=os.getenv("CATEGORY_JOB_TIMEOUT", "20m"),
                 result_ttl=int(os.getenv("CATEGORY_RESULT_TTL_S", "86400")),
                 failure_ttl=int(os.getenv("CATEGORY_FAILURE_TTL_S", "86400")),
             )
-            queued += 1
-        except Exception:
-            clear_category_claim(rid)
-            continue
-    return queued
+            for rid in claimed
+        ])
+    except Exception as e:
+        clear_category_claims(claimed)
+        print(f"[categorizer-scheduler] enqueue failed, claims released: {e}")
+        return 0
+    return len(claimed)
 
 
 def run_scheduler_forever() -> None:
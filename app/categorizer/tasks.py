@@ -7,6 +7,7 @@ from app.categorizer.db import (
 )
 from app.categorizer.logic import categorize_recipe
 from app.queue import clear_category_claim
+from app.media.llm_client import get_client
 
 
 def process_recipe_category_job(recipe_id: int) -> Dict[str, Any]:
@@ -42,6 +43,7 @@ def process_recipe_category_job(recipe_id: int) -> Dict[str, Any]:
             "category_names": selected_names,
             "category_ids": category_ids,
             "score_snapshot": scores,
+            "llm": get_client().metrics(),
         }
     finally:
         # release scheduler claim so it can be re-queued in edge cases
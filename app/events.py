@@ -0,0 +1,172 @@
+import json
+import os
+import time
+from typing import Any, AsyncIterator, Dict, Optional
+
+from app.progress import utcnow_iso
+
+
+# Per-recipe progress events for live UIs (GET /v1/recipes/{id}/events streams them as SSE).
+#
+# recipe-assets:events:{id}    Redis stream, one entry per event: {type, data (JSON)}
+# recipe-assets:progress:{id}  hash with the counters the ETA is derived from
+#
+# Publishing is best effort: a Redis problem is logged and never fails a generation job.
+
+def events_enabled() -> bool:
+    return os.getenv("PROGRESS_EVENTS", "true").lower() == "true"
+
+
+def stream_key(recipe_id: int) -> str:
+    return f"recipe-assets:events:{int(recipe_id)}"
+
+
+def _stats_key(recipe_id: int) -> str:
+    return f"recipe-assets:progress:{int(recipe_id)}"
+
+
+def _ttl_s() -> int:
+    return int(os.getenv("PROGRESS_EVENTS_TTL_S", "86400"))
+
+
+def _xadd(r, recipe_id: int, event_type: str, data: Dict[str, Any]) -> None:
+    data = dict(data, type=event_type, recipe_id=int(recipe_id), ts=utcnow_iso())
+    key = stream_key(recipe_id)
+    pipe = r.pipeline(transaction=False)
+    pipe.xadd(
+        key,
+        {"type": event_type, "data": json.dumps(data, ensure_ascii=False, default=str)},
+        maxlen=int(os.getenv("PROGRESS_EVENTS_MAXLEN", "1000")),
+        approximate=True,
+    )
+    pipe.expire(key, _ttl_s())
+    pipe.execute()
+
+
+def _counts(manifest: Dict[str, Any]) -> Dict[str, int]:
+    plan = manifest.get("plan") or {}
+    total = len(plan.get("ingredients") or []) + len(plan.get("steps") or [])
+    done = failed = 0
+    for section in ("ingredients", "steps"):
+        for item in (manifest.get(section) or {}).values():
+            if item.get("status") == "done":
+                done += 1
+            elif item.get("status") == "failed":
+                failed += 1
+    return {"total": total, "done": done, "failed": failed}
+
+
+def job_started(recipe_id: int, manifest: Dict[str, Any], job_id: Optional[str] = None) -> None:
+    """Reset the recipe's counters from the manifest (items already done count as done)."""
+    if not events_enabled():
+        return
+    try:
+        from app.queue import get_redis
+        r = get_redis()
+        counts = _counts(manifest)
+        # failed items are retried by this job: only "done" carries over
+        stats = {"total": counts["total"], "done": counts["done"], "failed": 0,
+                 "baseline": counts["done"], "started_at": time.time(), "job_id": job_id or ""}
+        pipe = r.pipeline(transaction=False)
+        pipe.delete(_stats_key(recipe_id))
+        pipe.hset(_stats_key(recipe_id), mapping=stats)
+        pipe.expire(_stats_key(recipe_id), _ttl_s())
+        pipe.execute()
+        _xadd(r, recipe_id, "job_started", {"job_id": job_id, "total": counts["total"], "done": counts["done"]})
+    except Exception as e:
+        print(f"[progress-events] publish failed: {e}")
+
+
+def _eta_s(stats: Dict[str, float]) -> Optional[float]:
+    """Remaining items at the throughput observed since job_started (None until one item settles)."""
+    settled = stats["done"] + stats["failed"] - stats["baseline"]
+    remaining = stats["total"] - stats["done"] - stats["failed"]
+    if settled <= 0 or remaining < 0:
+        return None
+    elapsed = time.time() - stats["started_at"]
+    return round(elapsed / settled * remaining, 1)
+
+
+def item_event(recipe_id: int, section: str, idx: int, fields: Dict[str, Any]) -> None:
+    """Publish an item status change: running -> item_started, done -> item_done, failed -> item_failed."""
+    status = fields.get("status")
+    if not events_enabled() or status not in ("running", "done", "failed"):
+        return
+    try:
+        from app.queue import get_redis
+        r = get_redis()
+        data: Dict[str, Any] = {"section": section, "index": int(idx), "status": status}
+        if status == "running":
+            event_type = "item_started"
+        else:
+            event_type = f"item_{status}"
+            pipe = r.pipeline(transaction=False)
+            pipe.hincrby(_stats_key(recipe_id), status, 1)
+            pipe.hgetall(_stats_key(recipe_id))
+            raw = pipe.execute()[1]
+            if raw and b"total" in raw:
+                stats = {k.decode(): float(v) for k, v in raw.items() if k != b"job_id"}
+                data.update(done=int(stats["done"]), failed=int(stats["failed"]),
+                            total=int(stats["total"]), eta_s=_eta_s(stats))
+            if status == "done":
+                data["files"] = fields.get("files") or []
+            else:
+                data["error"] = str(fields.get("error") or "")[:500]
+        _xadd(r, recipe_id, event_type, data)
+    except Exception as e:
+        print(f"[progress-events] publish failed: {e}")
+
+
+def job_finished(recipe_id: int, ok: bool, error: Optional[str] = None) -> None:
+    if not events_enabled():
+        return
+    try:
+        from app.queue import get_redis
+        data: Dict[str, Any] = {"ok": ok}
+        if error:
+            data["error"] = error[:500]
+        _xadd(get_redis(), recipe_id, "job_finished" if ok else "job_failed", data)
+    except Exception as e:
+        print(f"[progress-events] publish failed: {e}")
+
+
+# ----------------- SSE (API side) -----------------
+_async_client = None
+
+
+def get_async_redis():
+    """asyncio client for SSE streams: blocking XREADs must not hold the sync pool's connections."""
+    global _async_client
+    if _async_client is None:
+        import redis.asyncio as aioredis
+        pool = aioredis.BlockingConnectionPool.from_url(
+            os.getenv("REDIS_URL", "redis://localhost:6379/0"),
+            max_connections=int(os.getenv("SSE_MAX_STREAMS", "200")),
+            timeout=float(os.getenv("REDIS_POOL_TIMEOUT_S", "20")),
+            health_check_interval=int(os.getenv("REDIS_HEALTH_CHECK_INTERVAL_S", "30")),
+        )
+        _async_client = aioredis.Redis(connection_pool=pool)
+    return _async_client
+
+
+async def sse_events(recipe_id: int, last_id: str, is_disconnected) -> AsyncIterator[str]:
+    """
+    Server-Sent Events for one recipe, starting after `last_id` ("0" = all retained events).
+
+    Each event's SSE id is its stream id, so a reconnecting EventSource resumes exactly where it
+    stopped (Last-Event-ID). A comment line is sent every SSE_KEEPALIVE_S while idle.
+    """
+    r = get_async_redis()
+    key = stream_key(recipe_id)
+    block_ms = int(float(os.getenv("SSE_KEEPALIVE_S", "15")) * 1000)
+    yield "retry: 3000\n\n"
+    while not await is_disconnected():
+        resp = await r.xread({key: last_id}, count=100, block=block_ms)
+        if not resp:
+            yield ": keepalive\n\n"
+            continue
+        for _, entries in resp:
+            for xid, fields in entries:
+                last_id = xid.decode() if isinstance(xid, bytes) else xid
+                event_type = fields[b"type"].decode()
+                yield f"id: {last_id}\nevent: {event_type}\ndata: {fields[b'data'].decode()}\n\n"
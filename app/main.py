@@ -1,21 +1,43 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import Response, StreamingResponse
 from fastapi.staticfiles import StaticFiles
+from rq import Queue
 from rq.job import Job
 
+import hashlib
+import json
 import os
+import threading
 import time
+import uuid
+from collections import OrderedDict
 import requests
+from typing import Optional
 
 from app.models import RecipeIn, EnqueueResponse, JobStatus, CategoryEnqueueIn, CategoryEnqueueResponse
+from app.models import BulkRecipesIn, BulkEnqueueResponse, BatchStatus
 from app.queue import (
+    LANES,
+    assets_job_id,
+    batch_key,
+    claim_assets_enqueue,
+    claim_assets_enqueue_many,
+    release_assets_enqueue,
+    release_assets_enqueue_many,
     get_queue,
     get_redis,
+    inflight_jobs,
+    job_statuses,
+    record_batch,
     get_category_queue,
     claim_category_recipe,
     clear_category_claim,
 )
 from app.tasks import generate_assets_job
-from app.progress import load_manifest
+from app.progress import load_manifest, manifest_stamp, utcnow_iso
+from app.events import sse_events
+from app.media.encode_profiles import PROFILES
+from app.worker import ready_workers
 from app.categorizer.db import check_postgres
 
 
@@ -33,6 +55,15 @@ def _check_redis() -> dict:
         return {"ok": False, "error": str(e)}
 
 
+def _check_asset_workers() -> dict:
+    # Informational only: a stack without warm workers is still healthy
+    try:
+        workers = ready_workers(get_redis())
+        return {"ready": len(workers), "workers": workers}
+    except Exception as e:
+        return {"ready": 0, "error": str(e)}
+
+
 def _check_ollama() -> dict:
     base = os.getenv("OLLAMA_URL", "").strip()
     if not base:
@@ -66,25 +97,163 @@ def health_check():
     ollama_status = _check_ollama()
     pg_status = check_postgres()
     overall_ok = bool(redis_status.get("ok")) and bool(ollama_status.get("ok")) and bool(pg_status.get("ok"))
-    return {"ok": overall_ok, "services": {"redis": redis_status, "ollama": ollama_status, "postgres": pg_status}}
+    return {
+        "ok": overall_ok,
+        "services": {"redis": redis_status, "ollama": ollama_status, "postgres": pg_status},
+        "asset_workers": _check_asset_workers(),
+    }
 
 
 # ----------------- Asset generation endpoints -----------------
+def _inflight_assets_job(job_id: str) -> Optional[str]:
+    """
+    The job still working on this request, if any: the job itself, or - once it finished - the
+    job it deferred to (recipe locked by another job) or its fan-out finalizer.
+    """
+    return inflight_jobs(get_redis(), [job_id])[0]
+
+
 @app.post("/v1/recipes/assets", response_model=EnqueueResponse, status_code=202)
 def enqueue_assets(recipe: RecipeIn):
-    # IMPORTANT: This endpoint is idempotent-ish by recipe id: posting the same id again
-    # will RESUME generation by skipping already generated files.
+    # IMPORTANT: This endpoint is idempotent by recipe id + inputs: the job id is derived from
+    # them, so a retried / double-submitted POST returns the job already in flight
+    # (coalesced=true). Posting again after it ended will RESUME generation by skipping
+    # already generated files.
+    if recipe.encode_profile and recipe.encode_profile not in PROFILES:
+        raise HTTPException(status_code=422, detail=f"unknown encode_profile; expected one of {sorted(PROFILES)}")
+    payload = recipe.model_dump(by_alias=False)
+    job_id = assets_job_id(payload)
+
+    inflight = _inflight_assets_job(job_id)
+    if inflight:
+        return EnqueueResponse(job_id=inflight, status_url=f"/v1/jobs/{inflight}", coalesced=True)
+    if not claim_assets_enqueue(job_id):
+        # an identical POST is enqueuing this very job right now
+        return EnqueueResponse(job_id=job_id, status_url=f"/v1/jobs/{job_id}", coalesced=True)
+
     q = get_queue()
-    job = q.enqueue(
-        generate_assets_job,
-        recipe.model_dump(by_alias=False),
-        job_timeout=os.getenv("RQ_JOB_TIMEOUT", "48h"),
-        result_ttl=86400,
-        failure_ttl=86400,
-    )
+    try:
+        # re-check under the claim: another POST may have enqueued it since the first look
+        inflight = _inflight_assets_job(job_id)
+        if inflight:
+            return EnqueueResponse(job_id=inflight, status_url=f"/v1/jobs/{inflight}", coalesced=True)
+        job = q.enqueue(
+            generate_assets_job,
+            payload,
+            job_id=job_id,
+            job_timeout=os.getenv("RQ_JOB_TIMEOUT", "48h"),
+            result_ttl=86400,
+            failure_ttl=86400,
+        )
+    finally:
+        release_assets_enqueue(job_id)
     return EnqueueResponse(job_id=job.id, status_url=f"/v1/jobs/{job.id}")
 
 
+@app.post("/v1/recipes/assets/bulk", response_model=BulkEnqueueResponse, status_code=202)
+def enqueue_assets_bulk(body: BulkRecipesIn):
+    """
+    Enqueue many recipes at once (catalogue backfills) into one lane, as one batch.
+
+    Job ids are the same as for single POSTs, so recipes already queued/running are coalesced
+    and duplicates inside the batch are enqueued once. Like a single POST, each job id is claimed
+    first and checked for in-flight work under the claim (finished jobs are followed to their
+    deferral/finalizer, one pipelined round-trip per hop); the batch then tracks the job actually
+    doing the work. All enqueues plus the batch bookkeeping go to Redis in a single pipeline.
+    """
+    if body.lane not in LANES:
+        raise HTTPException(status_code=422, detail=f"unknown lane; expected one of {sorted(LANES)}")
+    limit = int(os.getenv("BULK_MAX_RECIPES", "5000"))
+    if len(body.recipes) > limit:
+        raise HTTPException(status_code=413, detail=f"at most {limit} recipes per bulk request")
+    bad = sorted({r.encode_profile for r in body.recipes if r.encode_profile and r.encode_profile not in PROFILES})
+    if bad:
+        raise HTTPException(status_code=422, detail=f"unknown encode_profile {bad}; expected one of {sorted(PROFILES)}")
+
+    payloads = {}
+    for recipe in body.recipes:
+        payload = recipe.model_dump(by_alias=False)
+        payloads.setdefault(assets_job_id(payload), payload)
+    job_ids = list(payloads)
+
+    rds = get_redis()
+    claimed = [j for j, ok in zip(job_ids, claim_assets_enqueue_many(job_ids)) if ok]
+    try:
+        # recipe -> job currently doing its work; unclaimed ids are being enqueued by another POST
+        current = {j: j for j in job_ids}
+        fresh = []
+        for j, inflight in zip(claimed, inflight_jobs(rds, claimed)):
+            if inflight:
+                current[j] = inflight
+            else:
+                fresh.append(j)
+
+        batch_id = uuid.uuid4().hex
+        q = get_queue(LANES[body.lane])
+        job_timeout = os.getenv("RQ_JOB_TIMEOUT", "48h")
+        with rds.pipeline() as pipe:
+            q.enqueue_many(
+                [
+                    Queue.prepare_data(
+                        generate_assets_job,
+                        (payloads[j],),
+                        job_id=j,
+                        timeout=job_timeout,
+                        result_ttl=86400,
+                        failure_ttl=86400,
+                        meta={"batch_id": batch_id, "batch_job": j},
+                    )
+                    for j in fresh
+                ],
+                pipeline=pipe,
+            )
+            record_batch(pipe, batch_id, body.lane, current, utcnow_iso())
+            pipe.execute()
+    finally:
+        release_assets_enqueue_many(claimed)
+
+    return BulkEnqueueResponse(
+        batch_id=batch_id,
+        lane=body.lane,
+        total=len(job_ids),
+        queued=len(fresh),
+        coalesced=len(job_ids) - len(fresh),
+        job_ids=job_ids,
+        status_url=f"/v1/batches/{batch_id}",
+    )
+
+
+@app.get("/v1/batches/{batch_id}", response_model=BatchStatus)
+def batch_status(batch_id: str):
+    """Aggregate progress of a bulk batch, by the status of each recipe's current job."""
+    rds = get_redis()
+    key = batch_key(batch_id)
+    info = {k.decode(): v.decode() for k, v in (rds.hgetall(key) or {}).items()}
+    if not info:
+        raise HTTPException(status_code=404, detail="batch not found (or expired)")
+    current = [v.decode() for v in (rds.hgetall(key + ":jobs") or {}).values()]
+
+    counts: dict = {}
+    failed = []
+    for job_id, status in zip(current, job_statuses(rds, current)):
+        status = status or "expired"
+        counts[status] = counts.get(status, 0) + 1
+        if status == "failed":
+            failed.append(job_id)
+    total = int(info.get("total") or len(current))
+    done = counts.get("finished", 0) + counts.get("failed", 0)
+    return BatchStatus(
+        batch_id=batch_id,
+        lane=info.get("lane", ""),
+        total=total,
+        created_at=info.get("created_at"),
+        counts=counts,
+        done=done,
+        progress=round(done / total, 4) if total else 1.0,
+        failed_job_ids=failed[:100],
+    )
+
+
 @app.get("/v1/jobs/{job_id}", response_model=JobStatus)
 def job_status(job_id: str):
     job = Job.fetch(job_id, connection=get_redis())
@@ -96,37 +265,126 @@ def job_status(job_id: str):
     )
 
 
-@app.get("/v1/recipes/{recipe_id}/assets")
-def recipe_assets(recipe_id: int):
-    m = load_manifest(ASSETS_BASE_DIR, recipe_id)
-    if not m:
-        raise HTTPException(status_code=404, detail="manifest not found for recipe id")
-
+def _asset_urls(recipe_id: int, m: dict) -> dict:
     def url_for(rel_path: str) -> str:
         rel_path = rel_path.lstrip("/")
         return f"/assets/{recipe_id}/{rel_path}"
 
-    out = {
-        "recipe_id": recipe_id,
-        "manifest": m,
-        "urls": {"ingredients": {}, "steps": {}},
-    }
+    urls = {"ingredients": {}, "steps": {}, "renditions": {}}
 
     ing = m.get("ingredients") or {}
     for k, item in ing.items():
         files = item.get("files") or []
         if files:
-            out["urls"]["ingredients"][k] = [url_for(f) for f in files]
+            urls["ingredients"][k] = [url_for(f) for f in files]
 
     steps = m.get("steps") or {}
     for k, item in steps.items():
         files = item.get("files") or []
         if files:
-            out["urls"]["steps"][k] = [url_for(f) for f in files]
+            urls["steps"][k] = [url_for(f) for f in files]
+        rend = item.get("renditions")
+        if rend and item.get("status") == "done":
+            d = rend["dir"]
+            urls["renditions"][k] = {
+                "hls": url_for(f"{d}/{rend['master']}"),
+                "variants": {v["name"]: url_for(f"{d}/{v['playlist']}") for v in rend.get("variants") or []},
+                "sprite": url_for(f"{d}/{rend['sprite']['file']}"),
+                "thumbnails_vtt": url_for(f"{d}/{rend['sprite']['vtt']}"),
+            }
+    return urls
+
 
+def _slim_assets(recipe_id: int, m: dict, urls: dict) -> dict:
+    """Status + URLs per item only: no plan, prompts, encode stats or tracebacks."""
+    out = {"recipe_id": recipe_id, "updated_at": m.get("updated_at"), "ingredients": {}, "steps": {}}
+    for section in ("ingredients", "steps"):
+        for k, item in (m.get(section) or {}).items():
+            slim = {"status": item.get("status"), "urls": urls[section].get(k, [])}
+            if section == "steps":
+                slim["type"] = item.get("type")
+                if k in urls["renditions"]:
+                    slim["renditions"] = urls["renditions"][k]
+            if item.get("status") == "failed":
+                slim["error"] = item.get("error")
+            out[section][k] = slim
     return out
 
 
+# (recipe_id, view) -> (manifest_stamp, etag, JSON body); LRU, MANIFEST_CACHE_SIZE entries
+_assets_cache: OrderedDict = OrderedDict()
+_assets_cache_lock = threading.Lock()
+
+
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    tags = [t.strip() for t in if_none_match.split(",")]
+    return "*" in tags or etag in tags or f"W/{etag}" in tags
+
+
+@app.get("/v1/recipes/{recipe_id}/assets")
+def recipe_assets(recipe_id: int, request: Request, view: str = "full"):
+    """
+    Manifest + asset URLs. view=slim returns only per-item status and URLs.
+
+    Responses carry an ETag derived from the manifest files' stamps (see manifest_stamp):
+    If-None-Match gets a 304 without reading the manifest, and unchanged manifests are served
+    from an in-process cache of rendered bodies instead of being re-parsed.
+    """
+    if view not in ("full", "slim"):
+        raise HTTPException(status_code=422, detail="view must be 'full' or 'slim'")
+    stamp = manifest_stamp(ASSETS_BASE_DIR, recipe_id)
+    if stamp is None:
+        raise HTTPException(status_code=404, detail="manifest not found for recipe id")
+    etag = '"%s"' % hashlib.sha1(repr((recipe_id, view, stamp)).encode()).hexdigest()[:20]
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if _etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+
+    key = (recipe_id, view)
+    with _assets_cache_lock:
+        hit = _assets_cache.get(key)
+        if hit and hit[0] == stamp:
+            _assets_cache.move_to_end(key)
+            return Response(content=hit[2], media_type="application/json", headers=headers)
+
+    m = load_manifest(ASSETS_BASE_DIR, recipe_id)
+    if not m:
+        raise HTTPException(status_code=404, detail="manifest not found for recipe id")
+    urls = _asset_urls(recipe_id, m)
+    if view == "slim":
+        out = _slim_assets(recipe_id, m, urls)
+    else:
+        out = {"recipe_id": recipe_id, "manifest": m, "urls": urls}
+    body = json.dumps(out, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+    with _assets_cache_lock:
+        _assets_cache[key] = (stamp, etag, body)
+        _assets_cache.move_to_end(key)
+        while len(_assets_cache) > int(os.getenv("MANIFEST_CACHE_SIZE", "512")):
+            _assets_cache.popitem(last=False)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
+@app.get("/v1/recipes/{recipe_id}/events")
+async def recipe_events(recipe_id: int, request: Request, last_event_id: Optional[str] = None):
+    """
+    Live progress of a recipe's asset jobs as Server-Sent Events (instead of polling
+    /v1/jobs/{id} and /v1/recipes/{id}/assets).
+
+    Events: job_started, item_started, item_done, item_failed (with done/total/eta_s),
+    job_finished, job_failed. Without a Last-Event-ID header (or ?last_event_id=) the retained
+    history is replayed first.
+    """
+    start = request.headers.get("last-event-id") or last_event_id or "0"
+    return StreamingResponse(
+        sse_events(recipe_id, start, request.is_disconnected),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 # ----------------- Recipe categorizer endpoints -----------------
 @app.post("/v1/categorizer/recipes/enqueue", response_model=CategoryEnqueueResponse, status_code=202)
 def enqueue_recipe_for_categorization(payload: CategoryEnqueueIn):
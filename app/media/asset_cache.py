@@ -0,0 +1,146 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+from contextlib import contextmanager
+from typing import Any, Iterator, Optional
+
+
+def cache_key(**params: Any) -> str:
+    """Content address for a generated asset: sha256 over the canonical JSON of its inputs."""
+    blob = json.dumps(params, ensure_ascii=False, sort_keys=True).encode("utf-8")
+    return hashlib.sha256(blob).hexdigest()
+
+
+def _link_or_copy(src: str, dst: str, link: bool = True) -> None:
+    # Materialize under a tmp name first so readers never observe a half-written file,
+    # and so an existing dst inode (possibly shared with the cache) is replaced, never truncated.
+    tmp = f"{dst}.{os.getpid()}.tmp"
+    if os.path.exists(tmp):
+        os.remove(tmp)
+    linked = False
+    if link:
+        try:
+            os.link(src, tmp)
+            linked = True
+        except OSError:
+            # different filesystem / no hardlink support
+            pass
+    if not linked:
+        shutil.copyfile(src, tmp)
+    os.replace(tmp, dst)
+
+
+@contextmanager
+def replacing(dst: str) -> Iterator[str]:
+    """
+    Yield a temp path next to dst (same extension) to write to; it replaces dst on success.
+
+    Files in a recipe directory may be hardlinks of cache entries (see AssetCache.fetch), so they
+    must be replaced, never rewritten in place - truncating one would corrupt the shared entry.
+    """
+    root, ext = os.path.splitext(dst)
+    tmp = f"{root}.{os.getpid()}.tmp{ext}"
+    try:
+        yield tmp
+        os.replace(tmp, dst)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+# ImageGen builds a fresh AssetCache per job, so the store counter that triggers eviction (and
+# the lock serializing it) are per process, not per instance.
+_stores = 0
+_evict_lock = threading.Lock()
+
+
+class AssetCache:
+    """
+    Shared, content-addressed store of generated files under {ASSETS_BASE_DIR}/_cache.
+
+    Entries are sharded by the first two hex chars of their key. Hits are hardlinked (or copied)
+    into the recipe directory and have their mtime bumped, so eviction by oldest mtime is LRU.
+    Stores copy, so the cache never shares an inode with the file it was stored from; writers of
+    recipe files go through replacing() so a hardlinked hit is never truncated.
+    """
+
+    def __init__(self, base_dir: Optional[str] = None, max_bytes: Optional[int] = None):
+        base_dir = base_dir or os.getenv("ASSETS_BASE_DIR", "/data/assets")
+        self.root = os.getenv("ASSET_CACHE_DIR") or os.path.join(base_dir, "_cache")
+        if max_bytes is None:
+            max_bytes = int(float(os.getenv("ASSET_CACHE_MAX_GB", "20")) * (1024 ** 3))
+        self.max_bytes = max_bytes
+        # eviction walks the whole cache, so only do it every N stores (counted per process)
+        self.evict_every = max(1, int(os.getenv("ASSET_CACHE_EVICT_EVERY", "50")))
+        self.hits = 0
+        self.misses = 0
+
+    def path_for(self, key: str, ext: str = ".png") -> str:
+        return os.path.join(self.root, key[:2], f"{key}{ext}")
+
+    def fetch(self, key: str, dst: str, ext: str = ".png") -> bool:
+        """Materialize a cached entry at dst. Returns False on miss."""
+        src = self.path_for(key, ext)
+        try:
+            if os.path.getsize(src) <= 0:
+                raise FileNotFoundError(src)
+            _link_or_copy(src, dst)
+            os.utime(src)
+        except OSError:
+            self.misses += 1
+            return False
+        self.hits += 1
+        return True
+
+    def store(self, key: str, src: str, ext: str = ".png") -> None:
+        if not (os.path.exists(src) and os.path.getsize(src) > 0):
+            return
+        dst = self.path_for(key, ext)
+        try:
+            os.makedirs(os.path.dirname(dst), exist_ok=True)
+            _link_or_copy(src, dst, link=False)
+        except OSError:
+            # the cache is an optimization; never fail generation because of it
+            return
+        global _stores
+        with _evict_lock:
+            _stores += 1
+            due = _stores % self.evict_every == 0
+        if due:
+            self.evict()
+
+    def evict(self) -> int:
+        """Drop least-recently-used entries until the cache fits max_bytes. Returns bytes freed."""
+        if self.max_bytes <= 0 or not os.path.isdir(self.root):
+            return 0
+        with _evict_lock:
+            entries = []
+            total = 0
+            for shard in os.scandir(self.root):
+                if not shard.is_dir():
+                    continue
+                for f in os.scandir(shard.path):
+                    if not f.is_file() or f.name.endswith(".tmp"):
+                        continue
+                    st = f.stat()
+                    entries.append((st.st_mtime, st.st_size, f.path))
+                    total += st.st_size
+
+            freed = 0
+            if total <= self.max_bytes:
+                return 0
+            for _, size, path in sorted(entries):
+                try:
+                    os.remove(path)
+                except OSError:
+                    continue
+                freed += size
+                if total - freed <= self.max_bytes:
+                    break
+            return freed
+
+
+def cache_enabled() -> bool:
+    return os.getenv("ASSET_CACHE", "true").lower() == "true"
@@ -0,0 +1,51 @@
+import os
+from typing import Any, Dict, List, Optional, Tuple
+
+# libx264 settings per profile. gop_s is the keyframe interval in seconds (converted to frames at
+# the encode fps; None = libx264's default); threads 0 = ffmpeg auto.
+PROFILES: Dict[str, Dict[str, Any]] = {
+    "fast-preview": {"preset": "veryfast", "crf": 28, "threads": 0, "tune": "fastdecode", "gop_s": 2, "faststart": True},
+    # libx264 defaults (medium / 23, default GOP): same frames as before profiles existed, plus faststart
+    "balanced": {"preset": "medium", "crf": 23, "threads": 0, "tune": None, "gop_s": None, "faststart": True},
+    "archive": {"preset": "slow", "crf": 18, "threads": 0, "tune": "film", "gop_s": 10, "faststart": True},
+}
+
+DEFAULT_PROFILE = "balanced"
+
+
+def resolve_profile(name: Optional[str] = None) -> Tuple[str, Dict[str, Any]]:
+    """
+    Pick a profile: explicit name (per request) > ENCODE_PROFILE (per environment) > balanced.
+    ENCODE_THREADS overrides the thread count of whichever profile is chosen.
+    """
+    name = (name or os.getenv("ENCODE_PROFILE", DEFAULT_PROFILE)).strip().lower()
+    if name not in PROFILES:
+        name = DEFAULT_PROFILE
+    profile = dict(PROFILES[name])
+    threads = os.getenv("ENCODE_THREADS", "").strip()
+    if threads:
+        profile["threads"] = int(threads)
+    return name, profile
+
+
+def codec_args(profile: Dict[str, Any], fps: int) -> List[str]:
+    """Encoder-only arguments (no muxer flags), for outputs that pick their own container."""
+    args = [
+        "-c:v", "libx264",
+        "-preset", str(profile["preset"]),
+        "-crf", str(profile["crf"]),
+        "-threads", str(profile["threads"]),
+        "-pix_fmt", "yuv420p",
+    ]
+    if profile.get("gop_s"):
+        args += ["-g", str(max(1, round(float(profile["gop_s"]) * int(fps))))]
+    if profile.get("tune"):
+        args += ["-tune", str(profile["tune"])]
+    return args
+
+
+def x264_args(profile: Dict[str, Any], fps: int) -> List[str]:
+    args = codec_args(profile, fps)
+    if profile.get("faststart"):
+        args += ["-movflags", "+faststart"]
+    return args
@@ -1,7 +1,161 @@
+import os
 import subprocess
+import tempfile
+import time
+from typing import Any, Dict, Iterable, List, Optional
 
 def run(cmd: list[str]):
     p = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
     if p.returncode != 0:
         raise RuntimeError(f"Command failed: {' '.join(cmd)}\n{p.stderr}")
     return p
+
+
+def _tail(path: str, max_bytes: int = 4000) -> str:
+    try:
+        with open(path, "rb") as f:
+            f.seek(0, os.SEEK_END)
+            f.seek(max(0, f.tell() - max_bytes))
+            return f.read().decode("utf-8", "replace")
+    except OSError:
+        return ""
+
+
+class FrameEncoder:
+    """
+    Long-lived ffmpeg process fed raw RGB frames over stdin.
+
+    Scaling and H.264 encoding happen in the same pass as generation, so no intermediate clip
+    files are written and every frame is encoded exactly once. Frames whose size differs from
+    (width, height) - e.g. fallback-resolution segments - are resized before being piped.
+
+    Use as a context manager: a clean exit finalizes the file, an exception kills ffmpeg.
+
+    output_spec replaces the default "-vf vf <output_args> -an out_path" tail of the command for
+    multi-output encodes (filter graphs, tee, HLS); out_path is then just the file stats are read from.
+    """
+
+    def __init__(
+        self,
+        out_path: str,
+        width: int,
+        height: int,
+        fps: int,
+        vf: str = "null",
+        output_args: Optional[List[str]] = None,
+        log_dir: Optional[str] = None,
+        output_spec: Optional[List[str]] = None,
+    ):
+        self.out_path = out_path
+        self.width = int(width)
+        self.height = int(height)
+        self.fps = int(fps)
+        self.vf = vf
+        self.output_args = output_args or ["-c:v", "libx264", "-pix_fmt", "yuv420p"]
+        self.log_dir = log_dir
+        self.output_spec = output_spec
+        self.frames_written = 0
+        self.stats: Dict[str, Any] = {}
+        self._proc: Optional[subprocess.Popen] = None
+        self._log_path: Optional[str] = None
+        self._started_at = 0.0
+
+    def command(self) -> List[str]:
+        outputs = self.output_spec or ["-vf", self.vf, *self.output_args, "-an", self.out_path]
+        return [
+            "ffmpeg", "-y", "-loglevel", "error",
+            "-f", "rawvideo", "-pix_fmt", "rgb24",
+            "-s", f"{self.width}x{self.height}", "-r", str(self.fps),
+            "-i", "-",
+            *outputs,
+        ]
+
+    def start(self) -> "FrameEncoder":
+        # stderr goes to a file: a PIPE nobody drains can fill up and deadlock the writer
+        fd, self._log_path = tempfile.mkstemp(prefix="ffmpeg_", suffix=".log", dir=self.log_dir)
+        with os.fdopen(fd, "wb") as log:
+            self._proc = subprocess.Popen(self.command(), stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=log)
+        self._started_at = time.time()
+        return self
+
+    def write(self, frame) -> None:
+        from PIL import Image
+
+        if not isinstance(frame, Image.Image):
+            frame = Image.fromarray(frame)
+        if frame.mode != "RGB":
+            frame = frame.convert("RGB")
+        if frame.size != (self.width, self.height):
+            frame = frame.resize((self.width, self.height), Image.LANCZOS)
+        try:
+            self._proc.stdin.write(frame.tobytes())
+        except BrokenPipeError:
+            self._proc.wait()
+            raise RuntimeError(f"ffmpeg exited early ({self._proc.returncode}):\n{_tail(self._log_path)}")
+        self.frames_written += 1
+
+    def write_frames(self, frames: Iterable) -> None:
+        for frame in frames:
+            self.write(frame)
+
+    def close(self) -> None:
+        if self._proc is None:
+            return
+        try:
+            self._proc.stdin.close()
+        except BrokenPipeError:
+            pass
+        flush_start = time.time()
+        # wait4 (not Popen.wait) so we also get ffmpeg's CPU time
+        _, status, usage = os.wait4(self._proc.pid, 0)
+        self._proc.returncode = code = os.waitstatus_to_exitcode(status)
+        log = _tail(self._log_path)
+        self._cleanup_log()
+        self._proc = None
+        if code != 0:
+            raise RuntimeError(f"Command failed: {' '.join(self.command())}\n{log}")
+        self.stats = self._encode_stats(time.time(), flush_start, usage)
+
+    def _encode_stats(self, ended_at: float, flush_start: float, usage) -> Dict[str, Any]:
+        duration_s = self.frames_written / self.fps if self.fps else 0
+        size = os.path.getsize(self.out_path) if os.path.exists(self.out_path) else 0
+        return {
+            # wall_s spans the whole stream (it overlaps generation); cpu_s is ffmpeg's own work
+            "wall_s": round(ended_at - self._started_at, 2),
+            "flush_s": round(ended_at - flush_start, 2),
+            "cpu_s": round(usage.ru_utime + usage.ru_stime, 2),
+            "frames": self.frames_written,
+            "duration_s": round(duration_s, 2),
+            "bytes": size,
+            "bitrate_kbps": round(size * 8 / duration_s / 1000, 1) if duration_s else None,
+        }
+
+    def abort(self) -> None:
+        if self._proc is None:
+            return
+        self._proc.kill()
+        self._proc.wait()
+        self._cleanup_log()
+        self._proc = None
+        # whatever was written is not a valid file
+        try:
+            os.remove(self.out_path)
+        except OSError:
+            pass
+
+    def _cleanup_log(self) -> None:
+        if self._log_path:
+            try:
+                os.remove(self._log_path)
+            except OSError:
+                pass
+            self._log_path = None
+
+    def __enter__(self) -> "FrameEncoder":
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
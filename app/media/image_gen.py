@@ -1,44 +1,161 @@
 import os
+from typing import Callable, List, Optional, Sequence, Tuple
+
 import torch
 from diffusers import StableDiffusionXLPipeline
 
-class ImageGen:
-    _pipe = None
+from app.media.asset_cache import AssetCache, cache_enabled, cache_key, replacing
+from app.media.residency import get_residency, target_device
+from app.media.seeds import derive_seed
+
+# (prompt, negative_prompt, out_path, seed)
+BatchItem = Tuple[str, Optional[str], str, Optional[int]]
+
+
+def _exists(path: str) -> bool:
+    return os.path.exists(path) and os.path.getsize(path) > 0
+
+
+def _chunk(items: List, size: int) -> List[List]:
+    return [items[i:i+size] for i in range(0, len(items), size)]
 
+
+def _load_sdxl():
+    device = target_device()
+    dtype = torch.float16 if device == "cuda" else torch.float32
+    pipe = StableDiffusionXLPipeline.from_pretrained(
+        os.getenv("SDXL_MODEL", "stabilityai/stable-diffusion-xl-base-1.0"),
+        torch_dtype=dtype,
+        variant="fp16" if device == "cuda" else None,
+    )
+    pipe.to(device)
+    pipe.set_progress_bar_config(disable=True)
+    return pipe
+
+
+get_residency().register("image", _load_sdxl)
+
+
+class ImageGen:
     def __init__(self):
-        device = os.getenv("DEVICE", "cuda")
-        self.device = device if (device == "cuda" and torch.cuda.is_available()) else "cpu"
-
-        if ImageGen._pipe is None:
-            dtype = torch.float16 if self.device == "cuda" else torch.float32
-            model_id = os.getenv("SDXL_MODEL", "stabilityai/stable-diffusion-xl-base-1.0")
-            ImageGen._pipe = StableDiffusionXLPipeline.from_pretrained(
-                model_id,
-                torch_dtype=dtype,
-                variant="fp16" if self.device == "cuda" else None,
-            )
-            ImageGen._pipe.to(self.device)
-            ImageGen._pipe.set_progress_bar_config(disable=True)
-
-    def generate_png(self, prompt: str, negative_prompt: str, out_path: str):
-        width = int(os.getenv("IMAGE_WIDTH", "1024"))
-        height = int(os.getenv("IMAGE_HEIGHT", "1024"))
-        steps = int(os.getenv("IMAGE_STEPS", "30"))
-        guidance = float(os.getenv("IMAGE_GUIDANCE", "6.5"))
-
-        g = torch.Generator(device=self.device).manual_seed(abs(hash(out_path)) % (2**31))
+        # Cheap: the SDXL pipeline is loaded on the first cache miss (or preloaded by app.worker.WarmWorker)
+        self.device = target_device()
+        self.model_id = os.getenv("SDXL_MODEL", "stabilityai/stable-diffusion-xl-base-1.0")
+        self.cache = AssetCache() if cache_enabled() else None
+
+    @staticmethod
+    def load_pipeline():
+        # Residency is managed process-wide (memory budget, offload/evict) by app.media.residency
+        return get_residency().acquire("image")
+
+    def _seed_for(self, out_path: str, seed: Optional[int]) -> int:
+        if seed is not None:
+            return int(seed) % (2**31)
+        return derive_seed(out_path)
+
+    def _params(self) -> dict:
+        return {
+            "width": int(os.getenv("IMAGE_WIDTH", "1024")),
+            "height": int(os.getenv("IMAGE_HEIGHT", "1024")),
+            "steps": int(os.getenv("IMAGE_STEPS", "30")),
+            "guidance": float(os.getenv("IMAGE_GUIDANCE", "6.5")),
+        }
+
+    def _cache_key(self, item: BatchItem) -> str:
+        prompt, negative_prompt, out_path, seed = item
+        return cache_key(
+            model=self.model_id,
+            prompt=prompt,
+            negative_prompt=negative_prompt or "",
+            seed=self._seed_for(out_path, seed),
+            **self._params(),
+        )
+
+    def _run(self, items: List[BatchItem]) -> None:
+        params = self._params()
+
+        # One generator per item keeps each image identical to what a single-item call would produce
+        generators = [
+            torch.Generator(device=self.device).manual_seed(self._seed_for(out_path, seed))
+            for (_, _, out_path, seed) in items
+        ]
 
         with torch.inference_mode():
-            img = ImageGen._pipe(
-                prompt=prompt,
-                negative_prompt=negative_prompt,
-                width=width,
-                height=height,
-                num_inference_steps=steps,
-                guidance_scale=guidance,
-                generator=g,
-            ).images[0]
-
-        img.save(out_path, format="PNG")
+            images = ImageGen.load_pipeline()(
+                prompt=[p for (p, _, _, _) in items],
+                negative_prompt=[n or "" for (_, n, _, _) in items],
+                width=params["width"],
+                height=params["height"],
+                num_inference_steps=params["steps"],
+                guidance_scale=params["guidance"],
+                generator=generators,
+            ).images
+
+        for item, img in zip(items, images):
+            with replacing(item[2]) as tmp:
+                img.save(tmp, format="PNG")
+            if self.cache is not None:
+                self.cache.store(self._cache_key(item), item[2])
         if self.device == "cuda":
             torch.cuda.empty_cache()
+
+    def generate_batch(
+        self,
+        items: Sequence[BatchItem],
+        batch_size: Optional[int] = None,
+        on_result: Optional[Callable[[int, Optional[Exception]], None]] = None,
+        on_start: Optional[Callable[[List[int]], None]] = None,
+    ) -> List[Optional[Exception]]:
+        """
+        Generate several PNGs with as few pipeline calls as possible.
+
+        Items whose out_path already exists are skipped (resume), and items already present in the
+        shared asset cache are linked in without touching SDXL. Remaining items are run in
+        micro-batches of IMAGE_BATCH_SIZE; if a micro-batch fails, its items are retried one by
+        one so a single bad prompt does not fail its neighbours.
+
+        Returns one entry per input item: None on success/skip, otherwise the exception.
+        on_result(index, error) is called as soon as each item is settled; on_start(indices) before
+        each micro-batch is run.
+        """
+        size = max(1, int(batch_size or os.getenv("IMAGE_BATCH_SIZE", "2")))
+        results: List[Optional[Exception]] = [None] * len(items)
+
+        pending = []
+        for idx, item in enumerate(items):
+            if _exists(item[2]) or (self.cache is not None and self.cache.fetch(self._cache_key(item), item[2])):
+                if on_result:
+                    on_result(idx, None)
+                continue
+            pending.append(idx)
+
+        for chunk in _chunk(pending, size):
+            if on_start:
+                on_start(chunk)
+            try:
+                self._run([items[idx] for idx in chunk])
+                settled = [(idx, None) for idx in chunk]
+            except Exception as batch_err:
+                if len(chunk) == 1:
+                    settled = [(chunk[0], batch_err)]
+                else:
+                    settled = []
+                    for idx in chunk:
+                        try:
+                            self._run([items[idx]])
+                            settled.append((idx, None))
+                        except Exception as e:
+                            settled.append((idx, e))
+
+            for idx, err in settled:
+                results[idx] = err
+                if on_result:
+                    on_result(idx, err)
+
+        return results
+
+    def generate_png(self, prompt: str, negative_prompt: str, out_path: str, seed: Optional[int] = None):
+        item = (prompt, negative_prompt, out_path, seed)
+        if self.cache is not None and self.cache.fetch(self._cache_key(item), out_path):
+            return
+        self._run([item])
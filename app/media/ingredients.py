@@ -0,0 +1,159 @@
+import json
+import os
+import re
+from functools import lru_cache
+from typing import Any, Dict, List, Optional
+
+from app.media.prompts import INGREDIENT_PHOTO_TEMPLATE, NEGATIVE_DEFAULT, STYLE_FOOD_PHOTO
+from app.media.seeds import derive_seed
+
+
+VOCAB_FILE = os.getenv(
+    "INGREDIENT_VOCAB_FILE",
+    os.path.join(os.path.dirname(__file__), "config", "ingredient_vocabulary.json"),
+)
+
+_UNICODE_FRACTIONS = {
+    "½": "1/2", "⅓": "1/3", "⅔": "2/3", "¼": "1/4", "¾": "3/4",
+    "⅕": "1/5", "⅛": "1/8", "⅜": "3/8", "⅝": "5/8", "⅞": "7/8",
+}
+
+# "1", "1.5", "1,5", "1/2", "1 1/2", "1-2", "1 to 2"
+_NUMBER = r"\d+(?:[.,]\d+)?(?:\s+\d+/\d+|/\d+)?"
+_QUANTITY_RE = re.compile(rf"^\s*({_NUMBER})(?:\s*(?:-|–|to)\s*({_NUMBER}))?\s*")
+
+
+@lru_cache(maxsize=1)
+def load_vocabulary() -> Dict[str, Any]:
+    """Load the canonical ingredient vocabulary (units, aliases, descriptors, invariant plurals)."""
+    if not os.path.exists(VOCAB_FILE):
+        return {"units": {}, "quantity_words": [], "descriptors": [], "invariant": [], "aliases": {}}
+    with open(VOCAB_FILE, "r", encoding="utf-8") as f:
+        data = json.load(f)
+
+    unit_aliases: Dict[str, str] = {}
+    for canonical, aliases in (data.get("units") or {}).items():
+        for a in [canonical] + list(aliases):
+            unit_aliases[a.strip().lower()] = canonical
+    return {
+        # longest first so "fl oz" wins over "oz" and "tablespoons" over "tablespoon"
+        "units": dict(sorted(unit_aliases.items(), key=lambda kv: -len(kv[0]))),
+        "quantity_words": sorted({w.lower() for w in data.get("quantity_words", [])}, key=len, reverse=True),
+        "descriptors": {w.lower() for w in data.get("descriptors", [])},
+        "invariant": {w.lower() for w in data.get("invariant", [])},
+        "aliases": {k.strip().lower(): v.strip().lower() for k, v in (data.get("aliases") or {}).items()},
+    }
+
+
+def _parse_number(s: str) -> Optional[float]:
+    s = s.strip().replace(",", ".")
+    total = 0.0
+    try:
+        for part in s.split():
+            if "/" in part:
+                num, den = part.split("/", 1)
+                total += float(num) / float(den)
+            else:
+                total += float(part)
+    except (ValueError, ZeroDivisionError):
+        return None
+    return total
+
+
+def singularize(word: str, invariant: Optional[set] = None) -> str:
+    w = word.lower()
+    if invariant and w in invariant:
+        return w
+    if len(w) <= 3 or w.endswith(("ss", "us", "is")):
+        return w
+    if w.endswith("ies"):
+        return w[:-3] + "y"
+    if w.endswith("oes"):
+        return w[:-2]
+    if w.endswith("ves") and w not in ("cloves", "olives", "chives"):
+        return w[:-3] + "f"
+    if w.endswith(("ches", "shes", "xes", "sses", "zes")):
+        return w[:-2]
+    if w.endswith("s"):
+        return w[:-1]
+    return w
+
+
+def normalize_ingredient(text: str) -> Dict[str, Any]:
+    """
+    Parse a free-form ingredient line ("1 1/2 cups of chopped tomatoes") into
+    {"key", "quantity", "unit", "raw"}.
+
+    `key` is stable across recipes: quantities, units, preparation notes and plurals are dropped
+    and the remainder is mapped through the canonical vocabulary.
+    """
+    vocab = load_vocabulary()
+    raw = text or ""
+    t = raw.lower().strip()
+    for uf, ascii_frac in _UNICODE_FRACTIONS.items():
+        t = t.replace(uf, f" {ascii_frac}")
+
+    # Drop parentheticals and trailing prep notes: "onion (large), finely chopped"
+    t = re.sub(r"\([^)]*\)", " ", t)
+    t = t.split(",", 1)[0]
+    t = re.sub(r"\bto taste\b|\bas needed\b|\bfor garnish\b|\bat room temperature\b", " ", t)
+    t = re.sub(r"\s+", " ", t).strip()
+
+    quantity = None
+    m = _QUANTITY_RE.match(t)
+    if m:
+        quantity = _parse_number(m.group(1))
+        t = t[m.end():]
+    # quantity words and articles stack ("half an onion", "2 dozen eggs"): strip until none is left
+    stripped = True
+    while stripped:
+        stripped = False
+        for w in vocab["quantity_words"]:
+            if t == w or t.startswith(w + " "):
+                t = t[len(w):].strip()
+                stripped = True
+                break
+
+    unit = None
+    for alias, canonical in vocab["units"].items():
+        # attached ("200g") has already been split by the quantity regex; "g sugar" / "g. sugar"
+        if t == alias or re.match(rf"^{re.escape(alias)}\.?\s", t):
+            unit = canonical
+            t = t[len(alias):].lstrip(". ")
+            break
+    t = re.sub(r"^of\s+", "", t)
+
+    words = [w for w in re.findall(r"[a-z][a-z'\-]*", t) if w not in vocab["descriptors"]]
+    if words:
+        words[-1] = singularize(words[-1], vocab["invariant"])
+    key = " ".join(words).strip()
+    key = vocab["aliases"].get(key, key)
+
+    if not key:
+        # nothing left after stripping (e.g. "2 large"); fall back to the raw text
+        key = re.sub(r"\s+", " ", raw.lower()).strip()
+
+    return {"key": key, "quantity": quantity, "unit": unit, "raw": raw}
+
+
+def ingredient_prompt(key: str) -> str:
+    """Deterministic studio-photo prompt for a canonical ingredient key."""
+    return INGREDIENT_PHOTO_TEMPLATE.format(style=STYLE_FOOD_PHOTO, name=key)
+
+
+def ingredient_seed(key: str) -> int:
+    # Depends on the key only (not recipe id / index) so the same ingredient is reusable everywhere
+    return derive_seed("ingredients", key)
+
+
+def plan_ingredients(ingredients: List[str]) -> List[Dict[str, Any]]:
+    out = []
+    for item in ingredients:
+        parsed = normalize_ingredient(item)
+        out.append({
+            "key": parsed["key"],
+            "prompt": ingredient_prompt(parsed["key"]),
+            "negative_prompt": NEGATIVE_DEFAULT,
+            "seed": ingredient_seed(parsed["key"]),
+        })
+    return out
@@ -1,16 +1,217 @@
 import json
 import re
-from typing import Any, Optional
+from typing import Any, Iterator, List, Optional, Tuple
 
-def extract_json_object(text: str) -> Optional[Any]:
+_WORD = re.compile(r"\w+")
+_PY_LITERALS = {"True": "true", "False": "false", "None": "null"}
+_CLOSERS = {"{": "}", "[": "]"}
+
+
+def iter_json_candidates(text: str) -> Iterator[Tuple[str, bool]]:
+    """
+    Yield every balanced top-level {...} / [...] span in one linear pass, as (span, truncated).
+
+    Quotes and backslash escapes are respected, so brackets inside string values don't count.
+    A single quote only opens a string where a JSON value/key can start (after { [ , :), so
+    apostrophes in prose ("chef's") are not mistaken for one. If the text ends inside a candidate (e.g. the model
+    hit num_predict) the remainder is yielded last with its open strings/brackets closed and
+    truncated=True.
+    """
+    start = None
+    stack: List[str] = []
+    quote = None
+    escape = False
+    prev = ""
+    for pos, ch in enumerate(text):
+        if start is None:
+            if ch in _CLOSERS:
+                start, stack, prev = pos, [ch], ch
+            continue
+        if quote:
+            if escape:
+                escape = False
+            elif ch == "\\":
+                escape = True
+            elif ch == quote:
+                quote = None
+            continue
+        if not ch.isspace():
+            prev, last = ch, prev
+        else:
+            continue
+        if ch == '"' or (ch == "'" and last in "{[,:"):
+            quote = ch
+        elif ch in _CLOSERS:
+            stack.append(ch)
+        elif ch in "}]":
+            stack.pop()
+            if not stack:
+                yield text[start: pos + 1], False
+                start = None
+    if start is not None:
+        tail = text[start:].rstrip().rstrip(",")
+        yield tail + (quote or "") + "".join(_CLOSERS[c] for c in reversed(stack)), True
+
+
+def _string_end(s: str, i: int, quote: str) -> int:
+    j = i + 1
+    while j < len(s):
+        if s[j] == "\\":
+            j += 2
+            continue
+        if s[j] == quote:
+            return j
+        j += 1
+    return len(s) - 1
+
+
+def _repair(s: str) -> Tuple[str, List[str]]:
+    """Fix common LLM JSON defects outside of strings; returns (fixed, names of repairs applied)."""
+    out: List[str] = []
+    applied: List[str] = []
+
+    def note(name: str) -> None:
+        if name not in applied:
+            applied.append(name)
+
+    i, n = 0, len(s)
+    prev = ""
+    while i < n:
+        ch = s[i]
+        if not ch.isspace():
+            last, prev = prev, ch
+        if ch == '"':
+            j = _string_end(s, i, '"')
+            out.append(s[i: j + 1])
+            i = j + 1
+        elif ch == "'" and last in "{[,:":
+            j = _string_end(s, i, "'")
+            body = s[i + 1: j].replace("\\'", "'").replace('"', '\\"')
+            out.append(f'"{body}"')
+            note("single_quotes")
+            i = j + 1
+        elif ch == ",":
+            k = i + 1
+            while k < n and s[k].isspace():
+                k += 1
+            if k < n and s[k] in "}]":
+                note("trailing_commas")
+            else:
+                out.append(ch)
+            i += 1
+        elif ch.isalpha() or ch == "_":
+            m = _WORD.match(s, i)
+            word = m.group(0) if m else ch
+            if word in _PY_LITERALS:
+                out.append(_PY_LITERALS[word])
+                note("python_literals")
+            else:
+                out.append(word)
+            i += len(word)
+        else:
+            out.append(ch)
+            i += 1
+    return "".join(out), applied
+
+
+def extract_json(text: str) -> Tuple[Optional[Any], List[str]]:
+    """
+    First JSON object/array in LLM output, tolerating common defects.
+
+    Candidates are tried in order of appearance, each as-is and then repaired (trailing commas,
+    single-quoted strings, Python True/False/None, truncated output). Returns (value, repairs), where
+    repairs names what had to be fixed ([] for a clean parse); (None, []) if nothing parses.
+
+    >>> extract_json('Steps {sauté onions} then {"a": 1}')
+    ({'a': 1}, [])
+    >>> extract_json('{"steps": ["chop"], notes: crème}')
+    (None, [])
+    """
     if not text:
-        return None
-    # Try to find the first JSON object or array in the text
-    m = re.search(r"(\{.*\}|\[.*\])", text, re.S)
-    if not m:
-        return None
-    blob = m.group(1)
-    try:
-        return json.loads(blob)
-    except Exception:
-        return None
+        return None, []
+    for candidate, truncated in iter_json_candidates(text):
+        if not truncated:
+            try:
+                return json.loads(candidate), []
+            except Exception:
+                pass
+        fixed, applied = _repair(candidate)
+        if truncated:
+            applied.append("closed_truncated")
+        try:
+            return json.loads(fixed), applied
+        except Exception:
+            continue
+    return None, []
+
+
+def extract_json_object(text: str) -> Optional[Any]:
+    return extract_json(text)[0]
+
+
+class JsonStreamTracker:
+    """
+    Incremental scanner for the first complete top-level JSON object/array in a token stream.
+
+    feed() text chunks as they arrive; it returns True once a balanced {...} or [...] that also
+    parses as JSON has been seen (strings and escapes are respected, so braces inside values don't
+    count). Text before the JSON (e.g. "Here is the plan:" or a ``` fence) is skipped, and a balanced
+    candidate that doesn't parse even after extract_json's repairs (prose like "{the plan}") is
+    dropped and scanning resumes.
+    """
+
+    def __init__(self):
+        self.buffer = ""
+        self.value: Any = None
+        self.done = False
+        self._pos = 0
+        self._start: Optional[int] = None
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+
+    def feed(self, chunk: str) -> bool:
+        if self.done or not chunk:
+            return self.done
+        self.buffer += chunk
+        buf = self.buffer
+        while self._pos < len(buf):
+            ch = buf[self._pos]
+            if self._start is None:
+                if ch in "{[":
+                    self._start, self._depth = self._pos, 1
+            elif self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+            elif ch == '"':
+                self._in_string = True
+            elif ch in "{[":
+                self._depth += 1
+            elif ch in "}]":
+                self._depth -= 1
+                if self._depth == 0 and self._close(self._pos):
+                    return True
+            self._pos += 1
+        return False
+
+    @property
+    def text(self) -> str:
+        """The JSON text once done (without surrounding prose), else everything received so far."""
+        return self.buffer[self._start: self._pos + 1] if self.done else self.buffer
+
+    def _close(self, end: int) -> bool:
+        span = self.buffer[self._start: end + 1]
+        try:
+            self.value = json.loads(span)
+        except Exception:
+            try:
+                self.value = json.loads(_repair(span)[0])
+            except Exception:
+                self._start = None
+                return False
+        self.done = True
+        return True
@@ -0,0 +1,191 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Optional
+
+
+def llm_cache_key(model: str, options: Dict[str, Any], system: str, prompt: str, mode: str = "") -> str:
+    blob = json.dumps(
+        {
+            "model": model,
+            "options": options,
+            "system": hashlib.sha256(system.encode("utf-8")).hexdigest(),
+            "prompt": hashlib.sha256(prompt.encode("utf-8")).hexdigest(),
+            "mode": mode,
+        },
+        sort_keys=True,
+    )
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+
+class _BaseCache:
+    """
+    get/put of LLM response text by key, with TTL (LLM_CACHE_TTL_S, 0 = no expiry) and a size
+    bound (LLM_CACHE_MAX_ENTRIES, least-recently-used out first).
+
+    Backend errors never fail an LLM call: they count as a miss / a skipped store.
+    """
+
+    def __init__(self, ttl_s: Optional[int] = None, max_entries: Optional[int] = None):
+        self.ttl_s = int(os.getenv("LLM_CACHE_TTL_S", str(30 * 86400))) if ttl_s is None else ttl_s
+        self.max_entries = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "50000")) if max_entries is None else max_entries
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+
+    def get(self, key: str) -> Optional[str]:
+        try:
+            value = self._get(key)
+        except Exception as e:
+            self.errors += 1
+            print(f"[llm-cache] get failed: {e}")
+            value = None
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def put(self, key: str, value: str) -> None:
+        try:
+            self._put(key, value)
+        except Exception as e:
+            self.errors += 1
+            print(f"[llm-cache] put failed: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        return {"backend": self.backend, "hits": self.hits, "misses": self.misses, "errors": self.errors}
+
+    backend = ""
+
+    def _get(self, key: str) -> Optional[str]:
+        raise NotImplementedError
+
+    def _put(self, key: str, value: str) -> None:
+        raise NotImplementedError
+
+
+class RedisLLMCache(_BaseCache):
+    """
+    Shared by every API/worker process. Values are plain keys with an expiry; a sorted set
+    (score = last access) gives the LRU order for the size bound.
+    """
+
+    backend = "redis"
+    PREFIX = "llm-cache:"
+    INDEX = "llm-cache:index"
+
+    def __init__(self, connection=None, **kwargs):
+        super().__init__(**kwargs)
+        if connection is None:
+            from app.queue import get_redis
+            connection = get_redis()
+        self.r = connection
+
+    def _get(self, key: str) -> Optional[str]:
+        raw = self.r.get(self.PREFIX + key)
+        if raw is None:
+            return None
+        self.r.zadd(self.INDEX, {key: time.time()})
+        return raw.decode("utf-8") if isinstance(raw, bytes) else str(raw)
+
+    def _put(self, key: str, value: str) -> None:
+        now = time.time()
+        pipe = self.r.pipeline()
+        if self.ttl_s > 0:
+            pipe.set(self.PREFIX + key, value, ex=self.ttl_s)
+            # index entries whose value has expired
+            pipe.zremrangebyscore(self.INDEX, "-inf", now - self.ttl_s)
+        else:
+            pipe.set(self.PREFIX + key, value)
+        pipe.zadd(self.INDEX, {key: now})
+        pipe.zcard(self.INDEX)
+        size = pipe.execute()[-1]
+        if self.max_entries > 0 and size > self.max_entries:
+            victims = self.r.zpopmin(self.INDEX, size - self.max_entries)
+            if victims:
+                self.r.delete(*[self.PREFIX + (k.decode() if isinstance(k, bytes) else k) for k, _ in victims])
+
+
+class SqliteLLMCache(_BaseCache):
+    """
+    Single-host cache in one SQLite file (LLM_CACHE_PATH, default {LLM_CACHE_DIR}/llm.sqlite3);
+    safe across threads and processes. Kept out of ASSETS_BASE_DIR, which is served at /assets.
+    """
+
+    backend = "sqlite"
+
+    def __init__(self, path: Optional[str] = None, **kwargs):
+        super().__init__(**kwargs)
+        if path is None:
+            cache_dir = os.getenv("LLM_CACHE_DIR", "/var/cache/media-generator")
+            path = os.getenv("LLM_CACHE_PATH", os.path.join(cache_dir, "llm.sqlite3"))
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        with self._lock, self._db:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS llm_cache ("
+                " key TEXT PRIMARY KEY, value TEXT NOT NULL, created REAL NOT NULL, accessed REAL NOT NULL)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS llm_cache_accessed ON llm_cache (accessed)")
+        self._puts = 0
+
+    def _get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock, self._db:
+            row = self._db.execute("SELECT value, created FROM llm_cache WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            if self.ttl_s > 0 and row[1] < now - self.ttl_s:
+                self._db.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+                return None
+            self._db.execute("UPDATE llm_cache SET accessed = ? WHERE key = ?", (now, key))
+            return row[0]
+
+    def _put(self, key: str, value: str) -> None:
+        now = time.time()
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, value, created, accessed) VALUES (?, ?, ?, ?)",
+                (key, value, now, now),
+            )
+            self._puts += 1
+            # Evict in batches, not on every write
+            if self._puts % 100 == 1:
+                self._evict(now)
+
+    def _evict(self, now: float) -> None:
+        if self.ttl_s > 0:
+            self._db.execute("DELETE FROM llm_cache WHERE created < ?", (now - self.ttl_s,))
+        if self.max_entries > 0:
+            self._db.execute(
+                "DELETE FROM llm_cache WHERE key IN ("
+                " SELECT key FROM llm_cache ORDER BY accessed DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+
+
+_cache: Optional[_BaseCache] = None
+_cache_pid: Optional[int] = None
+
+
+def get_llm_cache() -> Optional[_BaseCache]:
+    """LLM_CACHE=redis (default) | sqlite | off."""
+    global _cache, _cache_pid
+    backend = os.getenv("LLM_CACHE", "redis").strip().lower()
+    if backend in ("", "off", "false", "none"):
+        return None
+    if _cache is None or _cache_pid != os.getpid() or _cache.backend != backend:
+        try:
+            _cache = SqliteLLMCache() if backend == "sqlite" else RedisLLMCache()
+        except Exception as e:
+            print(f"[llm-cache] disabled, backend {backend} unavailable: {e}")
+            return None
+        _cache_pid = os.getpid()
+    return _cache
@@ -1,29 +1,351 @@
+import asyncio
+import hashlib
+import json
 import os
+import random
+import threading
+import time
+from typing import Any, Callable, Dict, Optional, Type, TypeVar
+
+from pydantic import BaseModel, ValidationError
+
 import requests
+from requests.adapters import HTTPAdapter
+
+from app.media.json_utils import JsonStreamTracker, extract_json, extract_json_object
+from app.media.llm_cache import get_llm_cache, llm_cache_key
+
+
+M = TypeVar("M", bound=BaseModel)
+
+# Retried with backoff: Ollama answers 503 while loading a model / when its queue is full
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+
+class OllamaClient:
+    """
+    Pooled Ollama /api/generate client shared by the planner, step rewriter and categorizer.
+
+    - One keep-alive requests.Session (LLM_POOL_SIZE connections) instead of a new TCP connection per call.
+    - At most LLM_MAX_CONCURRENCY in-flight calls per model; extra callers wait instead of piling
+      onto a busy Ollama.
+    - 5xx / 429 / timeouts / connection errors are retried LLM_MAX_RETRIES times with exponential
+      backoff + jitter (LLM_BACKOFF_S, 2x, ...). Other 4xx fail immediately.
+    - metrics() reports per-model calls, errors, retries, latency and Ollama token counts.
+    - stop_at_json=True streams the NDJSON response and disconnects as soon as the first top-level
+      JSON value is complete (Ollama stops generating when the client goes away), instead of
+      paying for trailing commentary up to num_predict. Disabled with LLM_STREAM=false.
+    - Responses are cached by (model, options, system, prompt) in app.media.llm_cache (LLM_CACHE);
+      JSON-mode answers are only cached if they contain parseable JSON.
+    - generate_json() sends a JSON Schema as Ollama `format`, validates the answer against a
+      pydantic model and asks once more with the validation error if it doesn't fit.
+
+    agenerate() is the asyncio flavour: same pool, same limits, run in a worker thread.
+    """
+
+    def __init__(
+        self,
+        base_url: Optional[str] = None,
+        pool_size: Optional[int] = None,
+        max_concurrency: Optional[int] = None,
+        max_retries: Optional[int] = None,
+        backoff_s: Optional[float] = None,
+    ):
+        self.base_url = base_url
+        self.max_concurrency = max_concurrency or int(os.getenv("LLM_MAX_CONCURRENCY", "2"))
+        self.max_retries = int(os.getenv("LLM_MAX_RETRIES", "3")) if max_retries is None else max_retries
+        self.backoff_s = float(os.getenv("LLM_BACKOFF_S", "1.0")) if backoff_s is None else backoff_s
+        pool_size = pool_size or int(os.getenv("LLM_POOL_SIZE", "8"))
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        self._lock = threading.Lock()
+        self._slots: Dict[str, threading.BoundedSemaphore] = {}
+        self._metrics: Dict[str, Dict[str, Any]] = {}
 
-def ollama_generate(system: str, prompt: str, timeout_s: int = 180) -> str:
-    ollama = os.getenv("OLLAMA_URL", "").strip()
-    model = os.getenv("LLM_MODEL", "phi4-mini:3.8b")
-    temperature = float(os.getenv("LLM_TEMPERATURE", "0.2"))
-    max_tokens = int(os.getenv("LLM_MAX_TOKENS", "2048"))
+    # ----------------- public API -----------------
+    def generate(
+        self,
+        system: str,
+        prompt: str,
+        model: Optional[str] = None,
+        options: Optional[Dict[str, Any]] = None,
+        timeout_s: int = 180,
+        stop_at_json: bool = False,
+        format: Optional[Any] = None,
+        accept: Optional[Callable[[str], bool]] = None,
+    ) -> str:
+        body = self.generate_raw(
+            system, prompt, model=model, options=options, timeout_s=timeout_s,
+            stop_at_json=stop_at_json, format=format, accept=accept,
+        )
+        return (body.get("response") or "").strip()
 
-    if not ollama:
-        raise RuntimeError("OLLAMA_URL not set")
+    async def agenerate(
+        self,
+        system: str,
+        prompt: str,
+        model: Optional[str] = None,
+        options: Optional[Dict[str, Any]] = None,
+        timeout_s: int = 180,
+        stop_at_json: bool = False,
+        format: Optional[Any] = None,
+        accept: Optional[Callable[[str], bool]] = None,
+    ) -> str:
+        """generate() off the event loop; format/accept constrain and vet the answer the same way."""
+        return await asyncio.to_thread(
+            self.generate, system, prompt, model=model, options=options, timeout_s=timeout_s,
+            stop_at_json=stop_at_json, format=format, accept=accept,
+        )
 
-    r = requests.post(
-        f"{ollama}/api/generate",
-        json={
+    def generate_raw(
+        self,
+        system: str,
+        prompt: str,
+        model: Optional[str] = None,
+        options: Optional[Dict[str, Any]] = None,
+        timeout_s: int = 180,
+        stop_at_json: bool = False,
+        format: Optional[Any] = None,
+        accept: Optional[Callable[[str], bool]] = None,
+    ) -> Dict[str, Any]:
+        """
+        Full Ollama response body (response, eval_count, durations, ...).
+
+        format is passed through to Ollama ("json" or a JSON Schema). accept(text) decides whether
+        an answer may be cached (default: any non-empty text; parseable JSON with stop_at_json).
+        """
+        base_url = (self.base_url or os.getenv("OLLAMA_URL", "")).strip().rstrip("/")
+        if not base_url:
+            raise RuntimeError("OLLAMA_URL not set")
+        model = model or os.getenv("LLM_MODEL", "phi4-mini:3.8b")
+        payload = {
             "model": model,
             "system": system,
             "prompt": prompt,
-            "stream": False,
-            "options": {
-                "temperature": temperature,
-                # Ollama uses num_predict for token limit
-                "num_predict": max_tokens,
-            },
-        },
-        timeout=timeout_s,
-    )
-    r.raise_for_status()
-    return (r.json().get("response") or "").strip()
+            "stream": stop_at_json and _stream_enabled(),
+            "options": options if options is not None else default_options(),
+        }
+        mode = "json" if stop_at_json else "text"
+        if format is not None:
+            payload["format"] = format
+            mode += ":" + hashlib.sha256(json.dumps(format, sort_keys=True).encode("utf-8")).hexdigest()
+
+        cache = get_llm_cache()
+        key = llm_cache_key(model, payload["options"], system, prompt, mode=mode)
+        slot = self._slot(model)
+        if cache is not None:
+            cached = cache.get(key)
+            self._count(model, "cache_hits" if cached is not None else "cache_misses")
+            if cached is not None:
+                return {"model": model, "response": cached, "cached": True}
+
+        with slot:
+            body = self._post_with_retries(f"{base_url}/api/generate", payload, model, timeout_s)
+
+        text = (body.get("response") or "").strip()
+        if accept is None:
+            accept = (lambda t: extract_json_object(t) is not None) if stop_at_json else bool
+        if cache is not None and text and accept(text):
+            cache.put(key, text)
+        return body
+
+    def generate_json(
+        self,
+        system: str,
+        prompt: str,
+        model_cls: Type[M],
+        schema: Optional[Dict[str, Any]] = None,
+        check: Optional[Callable[[M], None]] = None,
+        timeout_s: int = 180,
+    ) -> M:
+        """
+        Ask for JSON matching model_cls and return the validated model.
+
+        schema (default: model_cls' JSON Schema) goes to Ollama `format` so decoding is constrained
+        to it; check(result) may raise ValueError for rules a schema can't express. An answer that
+        fails parsing/validation gets LLM_REPAIR_RETRIES targeted retries that quote the error and
+        the previous answer. Raises LLMOutputError when no valid answer was produced.
+        """
+        schema = schema or model_cls.model_json_schema()
+        fmt = _format_for(schema)
+        repairs = int(os.getenv("LLM_REPAIR_RETRIES", "1"))
+
+        model = os.getenv("LLM_MODEL", "phi4-mini:3.8b")
+
+        def parse(text: str, count: bool = False) -> M:
+            data, fixes = extract_json(text)
+            if data is None:
+                raise ValueError("answer is not valid JSON")
+            if fixes and count:
+                print(f"[llm] repaired {model_cls.__name__} JSON: {', '.join(fixes)}")
+                self._count(model, "json_fixups")
+            result = model_cls.model_validate(data)
+            if check:
+                check(result)
+            return result
+
+        def acceptable(text: str) -> bool:
+            try:
+                parse(text)
+                return True
+            except (ValueError, ValidationError):
+                return False
+
+        ask = prompt
+        for attempt in range(repairs + 1):
+            text = self.generate(system, ask, timeout_s=timeout_s, stop_at_json=True, format=fmt, accept=acceptable)
+            try:
+                return parse(text, count=True)
+            except (ValueError, ValidationError) as e:
+                error = str(e)
+            self._count(model, "repairs")
+            ask = (
+                f"{prompt}\n\nYour previous answer was rejected: {error[:800]}\n"
+                f"Previous answer:\n{text[:4000]}\n\n"
+                "Return the corrected JSON only."
+            )
+        raise LLMOutputError(f"no valid {model_cls.__name__} after {repairs + 1} attempts: {error[:500]}")
+
+    def metrics(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            out = {}
+            for model, m in self._metrics.items():
+                ok = m["calls"] - m["errors"]
+                out[model] = dict(m, avg_latency_s=round(m["latency_s"] / ok, 3) if ok else None)
+            return out
+
+    # ----------------- internals -----------------
+    def _slot(self, model: str) -> threading.BoundedSemaphore:
+        with self._lock:
+            if model not in self._slots:
+                self._slots[model] = threading.BoundedSemaphore(self.max_concurrency)
+                self._metrics[model] = {
+                    "calls": 0, "errors": 0, "retries": 0, "latency_s": 0.0, "last_latency_s": None,
+                    "prompt_tokens": 0, "completion_tokens": 0, "early_stops": 0,
+                    "cache_hits": 0, "cache_misses": 0, "repairs": 0, "json_fixups": 0,
+                }
+            return self._slots[model]
+
+    def _post_with_retries(self, url: str, payload: Dict[str, Any], model: str, timeout_s: int) -> Dict[str, Any]:
+        attempt = 0
+        while True:
+            start = time.time()
+            try:
+                r = self.session.post(url, json=payload, timeout=timeout_s, stream=payload["stream"])
+                if r.status_code in RETRY_STATUS:
+                    raise _Retryable(f"Ollama HTTP {r.status_code}: {r.text[:200]}")
+                r.raise_for_status()
+                body = _read_stream(r) if payload["stream"] else r.json()
+            except (_Retryable, requests.Timeout, requests.ConnectionError, requests.exceptions.ChunkedEncodingError) as e:
+                if attempt >= self.max_retries:
+                    self._record(model, error=True)
+                    raise RuntimeError(f"Ollama call failed after {attempt + 1} attempts: {e}") from e
+                delay = self.backoff_s * (2 ** attempt)
+                time.sleep(delay + random.uniform(0, delay / 2))
+                attempt += 1
+                self._count(model, "retries")
+                continue
+            except Exception:
+                self._record(model, error=True)
+                raise
+            self._record(model, latency_s=time.time() - start, body=body)
+            return body
+
+    def _count(self, model: str, name: str) -> None:
+        with self._lock:
+            self._metrics[model][name] += 1
+
+    def _record(self, model: str, latency_s: float = 0.0, body: Optional[Dict[str, Any]] = None, error: bool = False) -> None:
+        with self._lock:
+            m = self._metrics[model]
+            m["calls"] += 1
+            if error:
+                m["errors"] += 1
+                return
+            m["latency_s"] = round(m["latency_s"] + latency_s, 3)
+            m["last_latency_s"] = round(latency_s, 3)
+            m["prompt_tokens"] += int((body or {}).get("prompt_eval_count") or 0)
+            m["completion_tokens"] += int((body or {}).get("eval_count") or 0)
+            m["early_stops"] += int(bool((body or {}).get("early_stop")))
+
+
+class LLMOutputError(ValueError):
+    pass
+
+
+class _Retryable(Exception):
+    pass
+
+
+def _format_for(schema: Dict[str, Any]) -> Any:
+    """LLM_FORMAT=schema (default, Ollama >= 0.5) | json (plain JSON mode) | none."""
+    mode = os.getenv("LLM_FORMAT", "schema").strip().lower()
+    if mode == "schema":
+        return schema
+    if mode == "json":
+        return "json"
+    return None
+
+
+def _read_stream(r: requests.Response) -> Dict[str, Any]:
+    """
+    Consume Ollama's NDJSON stream until the JSON answer is complete or generation ends.
+
+    On early stop the response is closed unread, which drops the connection (it is not returned to
+    the pool half-read) and makes Ollama cancel the request. eval_count is then the number of
+    streamed chunks, i.e. tokens actually generated.
+    """
+    tracker = JsonStreamTracker()
+    chunks = 0
+    try:
+        for line in r.iter_lines():
+            if not line:
+                continue
+            msg = json.loads(line)
+            if msg.get("error"):
+                raise RuntimeError(f"Ollama error: {msg['error']}")
+            if msg.get("done"):
+                return dict(msg, response=tracker.buffer)
+            chunks += 1
+            if tracker.feed(msg.get("response") or ""):
+                return {"response": tracker.text, "eval_count": chunks, "early_stop": True}
+    finally:
+        r.close()
+    raise requests.exceptions.ChunkedEncodingError("Ollama stream ended without a done message")
+
+
+def _stream_enabled() -> bool:
+    return os.getenv("LLM_STREAM", "true").lower() == "true"
+
+
+def default_options() -> Dict[str, Any]:
+    return {
+        "temperature": float(os.getenv("LLM_TEMPERATURE", "0.2")),
+        # Ollama uses num_predict for token limit
+        "num_predict": int(os.getenv("LLM_MAX_TOKENS", "2048")),
+    }
+
+
+_client: Optional[OllamaClient] = None
+_client_pid: Optional[int] = None
+
+
+def get_client() -> OllamaClient:
+    # A session must not be shared across fork (RQ work horses), so rebuild per process
+    global _client, _client_pid
+    if _client is None or _client_pid != os.getpid():
+        _client = OllamaClient()
+        _client_pid = os.getpid()
+    return _client
+
+
+def ollama_generate(system: str, prompt: str, timeout_s: int = 180, stop_at_json: bool = False) -> str:
+    return get_client().generate(system, prompt, timeout_s=timeout_s, stop_at_json=stop_at_json)
+
+
+def ollama_generate_json(system: str, prompt: str, model_cls: Type[M], timeout_s: int = 180, **kwargs: Any) -> M:
+    return get_client().generate_json(system, prompt, model_cls, timeout_s=timeout_s, **kwargs)
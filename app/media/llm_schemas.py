@@ -0,0 +1,60 @@
+from typing import Any, Dict, List, Literal
+
+from pydantic import BaseModel, Field
+
+
+# Output models for every JSON-returning prompt. The JSON Schema of each model is sent to Ollama
+# as `format` (constrained decoding) and the answer is validated against the same model.
+# The *_schema() helpers tighten the static schema with per-call facts (counts, allowed values).
+
+
+class RewrittenStep(BaseModel):
+    i: int
+    text: str
+
+
+class RewriteOut(BaseModel):
+    rewritten_steps: List[RewrittenStep]
+
+
+class ShotOut(BaseModel):
+    duration_s: int = 6
+    prompt: str
+
+
+class StepPlanOut(BaseModel):
+    media_type: Literal["image", "video"]
+    prompt: str
+    negative_prompt: str = ""
+    target_seconds: int = 0
+    shots: List[ShotOut] = Field(default_factory=list)
+
+
+class PlanOut(BaseModel):
+    steps: List[StepPlanOut]
+
+
+class CategoryOut(BaseModel):
+    categories: List[str]
+    confidence: float = 0.0
+    notes: str = ""
+
+
+def rewrite_schema(indices: List[int]) -> Dict[str, Any]:
+    schema = RewriteOut.model_json_schema()
+    schema["properties"]["rewritten_steps"].update(minItems=len(indices), maxItems=len(indices))
+    schema["$defs"]["RewrittenStep"]["properties"]["i"]["enum"] = list(indices)
+    return schema
+
+
+def plan_schema(n_steps: int, max_shots: int) -> Dict[str, Any]:
+    schema = PlanOut.model_json_schema()
+    schema["properties"]["steps"].update(minItems=n_steps, maxItems=n_steps)
+    schema["$defs"]["StepPlanOut"]["properties"]["shots"]["maxItems"] = max_shots
+    return schema
+
+
+def category_schema(allowed: List[str]) -> Dict[str, Any]:
+    schema = CategoryOut.model_json_schema()
+    schema["properties"]["categories"].update(minItems=1, items={"type": "string", "enum": list(allowed)})
+    return schema
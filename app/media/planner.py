@@ -1,16 +1,18 @@
+import hashlib
 import os
-import re
-from typing import List, Dict, Any
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Optional
 
-from app.media.llm_client import ollama_generate
-from app.media.json_utils import extract_json_object
+from app.media.llm_client import ollama_generate_json
+from app.media.llm_schemas import PlanOut, plan_schema
+from app.media.ingredients import plan_ingredients
 from app.media.prompts import NEGATIVE_DEFAULT, STYLE_FOOD_PHOTO, STYLE_COOKING_VIDEO
 
 SYSTEM = """You are a media planner for recipe assets.
 You must output STRICT JSON only.
 
 Goals:
-- Ingredient assets: one studio-quality photo each.
 - Step assets:
   - Use "video" for active actions (mixing, frying, chopping, whisking, kneading, stirring, pouring, flipping, sautéing).
   - Use "image" for passive/waiting/transfer/resting/cooling/refrigerating/serving.
@@ -20,7 +22,6 @@ Goals:
 Return strict JSON schema:
 
 {
-  "ingredients": [{"prompt": str, "negative_prompt": str}],
   "steps": [{
       "media_type": "image"|"video",
       "prompt": str,
@@ -42,33 +43,37 @@ def _heuristic_step_type(step: str) -> str:
         return "video"
     return "image"
 
-def _strip_quantity(ingredient: str) -> str:
-    # Remove leading quantities like "2 tbsp", "1/2 cup", etc.
-    t = ingredient.strip()
-    t = re.sub(r"^\s*[\d/\.\-]+\s*(tbsp|tsp|cup|cups|g|kg|ml|l|oz|lb|pounds|pinch|dash)?\s*", "", t, flags=re.I)
-    return t.strip() or ingredient.strip()
+def step_plan_key(original: str, rewritten: str) -> str:
+    """Identity of one step's plan: a step is replanned only when its own text changes."""
+    blob = "\x1f".join([original or "", rewritten or "", os.getenv("LLM_MODEL", "phi4-mini:3.8b")])
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()[:16]
 
-def plan_recipe_media(recipe_id: int, ingredients: List[str], original_steps: List[str], rewritten_steps: List[str]) -> Dict[str, Any]:
-    default_seconds = int(os.getenv("VIDEO_TARGET_SECONDS_DEFAULT", "12"))
-    max_shots = int(os.getenv("VIDEO_MAX_SHOTS_PER_STEP", "3"))
 
-    # Fallback if LLM unavailable
-    if not os.getenv("OLLAMA_URL"):
-        return _fallback_plan(ingredients, rewritten_steps, default_seconds)
+def _windows(indices: List[int], size: int) -> List[List[int]]:
+    """Consecutive runs of indices, each at most `size` long (size <= 0: one window)."""
+    out: List[List[int]] = []
+    for i in indices:
+        if out and out[-1][-1] == i - 1 and (size <= 0 or len(out[-1]) < size):
+            out[-1].append(i)
+        else:
+            out.append([i])
+    return out
+
 
-    prompt = f"""Recipe id: {recipe_id}
+def _window_prompt(recipe_id: int, ingredients: List[str], original_steps: List[str], rewritten_steps: List[str], window: List[int], max_shots: int) -> str:
+    targets = [{"i": i, "original": original_steps[i] if i < len(original_steps) else "", "rewritten": rewritten_steps[i]} for i in window]
+    return f"""Recipe id: {recipe_id}
 
-Ingredients:
+Ingredients (context only):
 {ingredients}
 
-Original steps:
-{original_steps}
+All rewritten steps (context only, for continuity):
+{list(enumerate(rewritten_steps))}
 
-Rewritten steps (use these for storyboarding):
-{rewritten_steps}
+Plan ONLY these {len(window)} steps, in this order (one entry each in "steps"):
+{targets}
 
 Constraints:
-- Ingredient prompts should NOT include quantities; focus on the ingredient itself.
 - Use: {STYLE_FOOD_PHOTO}
 - Use for video shots: {STYLE_COOKING_VIDEO}
 - No audio.
@@ -80,88 +85,125 @@ For each step:
 
 Return strict JSON only."""
 
-    try:
-        resp = ollama_generate(SYSTEM, prompt, timeout_s=240)
-        data = extract_json_object(resp)
-        if not isinstance(data, dict):
-            return _fallback_plan(ingredients, rewritten_steps, default_seconds)
-
-        # sanitize
-        ing = []
-        for i, item in enumerate(data.get("ingredients", [])):
-            p = (item.get("prompt") or "").strip()
-            if not p:
-                name = _strip_quantity(ingredients[i]) if i < len(ingredients) else f"ingredient {i}"
-                p = f"{STYLE_FOOD_PHOTO}. Studio photo of {name}."
-            ing.append({"prompt": p, "negative_prompt": item.get("negative_prompt") or NEGATIVE_DEFAULT})
-
-        steps_out = []
-        for i, st in enumerate(data.get("steps", [])):
-            mt = st.get("media_type")
-            if mt not in ("image", "video"):
-                mt = _heuristic_step_type(rewritten_steps[i] if i < len(rewritten_steps) else "")
-            neg = st.get("negative_prompt") or NEGATIVE_DEFAULT
-            step_prompt = (st.get("prompt") or "").strip()
-            if not step_prompt:
-                step_prompt = f"{STYLE_FOOD_PHOTO}. {rewritten_steps[i] if i < len(rewritten_steps) else ''}"
-
-            target = int(st.get("target_seconds") or (default_seconds if mt == "video" else 0))
-
-            shots = []
-            if mt == "video":
-                raw_shots = st.get("shots") or []
-                for sh in raw_shots[:max_shots]:
-                    dur = int(sh.get("duration_s") or 6)
-                    sp = (sh.get("prompt") or "").strip()
-                    if sp:
-                        shots.append({"duration_s": dur, "prompt": sp})
-                if not shots:
-                    shots = [{"duration_s": min(6, target or 6), "prompt": f"{STYLE_COOKING_VIDEO}. {rewritten_steps[i]}"}]
-
-            steps_out.append({
-                "media_type": mt,
-                "prompt": step_prompt,
-                "negative_prompt": neg,
-                "target_seconds": target,
-                "shots": shots
-            })
-
-        # Ensure lengths match (ingredients count + step count)
-        if len(ing) != len(ingredients):
-            ing = _fallback_plan(ingredients, rewritten_steps, default_seconds)["ingredients"]
-        if len(steps_out) != len(rewritten_steps):
-            steps_out = _fallback_plan(ingredients, rewritten_steps, default_seconds)["steps"]
-
-        return {"ingredients": ing, "steps": steps_out}
-
-    except Exception:
-        return _fallback_plan(ingredients, rewritten_steps, default_seconds)
-
-def _fallback_plan(ingredients: List[str], steps: List[str], default_seconds: int) -> Dict[str, Any]:
-    ing = []
-    for item in ingredients:
-        name = _strip_quantity(item)
-        ing.append({
-            "prompt": f"{STYLE_FOOD_PHOTO}. Studio photo of {name}, clean neutral background.",
-            "negative_prompt": NEGATIVE_DEFAULT
-        })
-    step_items = []
-    for st in steps:
-        mt = _heuristic_step_type(st)
-        if mt == "image":
-            step_items.append({
-                "media_type": "image",
-                "prompt": f"{STYLE_FOOD_PHOTO}. {st}",
-                "negative_prompt": NEGATIVE_DEFAULT,
-                "target_seconds": 0,
-                "shots": []
-            })
+
+def _sanitize_step(st: Dict[str, Any], rewritten: str, default_seconds: int, max_shots: int) -> Dict[str, Any]:
+    mt = st.get("media_type")
+    if mt not in ("image", "video"):
+        mt = _heuristic_step_type(rewritten)
+    neg = st.get("negative_prompt") or NEGATIVE_DEFAULT
+    step_prompt = (st.get("prompt") or "").strip()
+    if not step_prompt:
+        step_prompt = f"{STYLE_FOOD_PHOTO}. {rewritten}"
+
+    target = int(st.get("target_seconds") or (default_seconds if mt == "video" else 0))
+
+    shots = []
+    if mt == "video":
+        raw_shots = st.get("shots") or []
+        for sh in raw_shots[:max_shots]:
+            dur = int(sh.get("duration_s") or 6)
+            sp = (sh.get("prompt") or "").strip()
+            if sp:
+                shots.append({"duration_s": dur, "prompt": sp})
+        if not shots:
+            shots = [{"duration_s": min(6, target or 6), "prompt": f"{STYLE_COOKING_VIDEO}. {rewritten}"}]
+
+    return {
+        "media_type": mt,
+        "prompt": step_prompt,
+        "negative_prompt": neg,
+        "target_seconds": target,
+        "shots": shots
+    }
+
+
+def _plan_window(recipe_id: int, ingredients: List[str], original_steps: List[str], rewritten_steps: List[str], window: List[int], default_seconds: int, max_shots: int) -> List[Dict[str, Any]]:
+    def _check(out: PlanOut) -> None:
+        if len(out.steps) != len(window):
+            raise ValueError(f"expected exactly {len(window)} steps, got {len(out.steps)}")
+
+    data = ollama_generate_json(
+        SYSTEM, _window_prompt(recipe_id, ingredients, original_steps, rewritten_steps, window, max_shots), PlanOut,
+        schema=plan_schema(len(window), max_shots),
+        check=_check,
+        timeout_s=int(os.getenv("PLAN_WINDOW_TIMEOUT_S", "240")),
+    )
+    return [_sanitize_step(st.model_dump(), rewritten_steps[i], default_seconds, max_shots) for i, st in zip(window, data.steps)]
+
+
+def plan_recipe_media(
+    recipe_id: int,
+    ingredients: List[str],
+    original_steps: List[str],
+    rewritten_steps: List[str],
+    cached_steps: Optional[Dict[str, Dict[str, Any]]] = None,
+) -> Dict[str, Any]:
+    """
+    Plan every step in windows of PLAN_WINDOW_STEPS consecutive steps (0 = one call for all).
+
+    - Each step entry carries plan_key (see step_plan_key); entries in cached_steps with the same key
+      are reused as-is, so editing one step replans only that step.
+    - Windows are planned in parallel (LLM_PARALLELISM) with the whole recipe as shared context.
+    - A window that fails (after the client's repair retry) falls back to heuristics for just its
+      steps instead of discarding the whole plan.
+    """
+    # Ingredient entries are never LLM-authored: they are templated from a canonical ingredient key
+    # (app.media.ingredients) so identical ingredients share prompts/seeds across recipes.
+    default_seconds = int(os.getenv("VIDEO_TARGET_SECONDS_DEFAULT", "12"))
+    max_shots = int(os.getenv("VIDEO_MAX_SHOTS_PER_STEP", "3"))
+    window_size = int(os.getenv("PLAN_WINDOW_STEPS", "4"))
+    parallelism = int(os.getenv("LLM_PARALLELISM", os.getenv("LLM_MAX_CONCURRENCY", "2")))
+    cached_steps = cached_steps or {}
+
+    keys = [step_plan_key(original_steps[i] if i < len(original_steps) else "", st) for i, st in enumerate(rewritten_steps)]
+    steps_out: List[Optional[Dict[str, Any]]] = [cached_steps.get(k) for k in keys]
+    todo = [i for i, st in enumerate(steps_out) if st is None]
+
+    def run(window: List[int]) -> Dict[str, Any]:
+        start = time.time()
+        # Fallback if LLM unavailable
+        if not os.getenv("OLLAMA_URL"):
+            planned, by, error = None, "heuristic", None
         else:
-            step_items.append({
-                "media_type": "video",
-                "prompt": f"{STYLE_FOOD_PHOTO}. {st}",
-                "negative_prompt": NEGATIVE_DEFAULT,
-                "target_seconds": default_seconds,
-                "shots": [{"duration_s": min(6, default_seconds), "prompt": f"{STYLE_COOKING_VIDEO}. {st}"}]
-            })
-    return {"ingredients": ing, "steps": step_items}
+            try:
+                planned, by, error = _plan_window(recipe_id, ingredients, original_steps, rewritten_steps, window, default_seconds, max_shots), "llm", None
+            except Exception as e:
+                planned, by, error = None, "heuristic", f"{type(e).__name__}: {e}"[:300]
+        if planned is None:
+            planned = [_fallback_step(rewritten_steps[i], default_seconds) for i in window]
+        for i, st in zip(window, planned):
+            steps_out[i] = dict(st, plan_key=keys[i], planned_by=by)
+        stats = {"indices": window, "planned_by": by, "seconds": round(time.time() - start, 2)}
+        if error:
+            stats["error"] = error
+        return stats
+
+    windows = _windows(todo, window_size)
+    with ThreadPoolExecutor(max_workers=max(1, min(parallelism, len(windows) or 1))) as pool:
+        stats = list(pool.map(run, windows))
+
+    return {
+        "ingredients": plan_ingredients(ingredients),
+        "steps": steps_out,
+        "windows": stats,
+        "reused_steps": len(rewritten_steps) - len(todo),
+    }
+
+
+def _fallback_step(st: str, default_seconds: int) -> Dict[str, Any]:
+    if _heuristic_step_type(st) == "image":
+        return {
+            "media_type": "image",
+            "prompt": f"{STYLE_FOOD_PHOTO}. {st}",
+            "negative_prompt": NEGATIVE_DEFAULT,
+            "target_seconds": 0,
+            "shots": []
+        }
+    return {
+        "media_type": "video",
+        "prompt": f"{STYLE_FOOD_PHOTO}. {st}",
+        "negative_prompt": NEGATIVE_DEFAULT,
+        "target_seconds": default_seconds,
+        "shots": [{"duration_s": min(6, default_seconds), "prompt": f"{STYLE_COOKING_VIDEO}. {st}"}]
+    }
+
@@ -9,3 +9,7 @@ STYLE_COOKING_VIDEO = (
     "realistic instructional cooking video, clean modern kitchen, minimal clutter, "
     "professional lighting, steady camera, no text, no logos, no watermark"
 )
+
+# Ingredient photos are templated from the canonical ingredient key (see app.media.ingredients)
+# so the same ingredient yields a byte-identical prompt in every recipe.
+INGREDIENT_PHOTO_TEMPLATE = "{style}. Studio photo of {name}, clean neutral background."
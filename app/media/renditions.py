@@ -0,0 +1,164 @@
+"""
+Adaptive outputs for a step video, produced by the same ffmpeg process that writes the main mp4.
+
+The raw frames are decoded/scaled once and split in a filter graph:
+- the main (source-resolution) encode is tee'd to both {i}.mp4 and the top HLS variant
+- each lower rendition gets its own scale + encode branch
+- a thumbnail branch tiles one frame every SPRITE_INTERVAL_S seconds into a single sprite
+
+Layout (all inside the step's renditions dir, e.g. steps/{i}/):
+    master.m3u8               HLS master playlist
+    {h}p.m3u8 + {h}p_NNN.ts   one variant per rendition
+    sprite.jpg + sprite.vtt   thumbnail sprite + WebVTT track (#xywh cues) for scrub previews
+"""
+import math
+import os
+from typing import Any, Dict, List, Tuple
+
+
+def renditions_enabled() -> bool:
+    return bool(os.getenv("VIDEO_RENDITIONS", "1080,720,480").strip())
+
+
+def _even(x: float) -> int:
+    return max(2, int(round(x / 2.0)) * 2)
+
+
+def rendition_heights(source_h: int) -> List[int]:
+    """Heights from VIDEO_RENDITIONS below the source height (the source itself is always a variant)."""
+    raw = os.getenv("VIDEO_RENDITIONS", "1080,720,480")
+    heights = {int(h.strip().lower().rstrip("p")) for h in raw.split(",") if h.strip()}
+    return sorted((h for h in heights if h < source_h), reverse=True)
+
+
+def build_output_spec(
+    mp4_path: str,
+    out_dir: str,
+    width: int,
+    height: int,
+    vf: str,
+    codec: List[str],
+    faststart: bool,
+    target_seconds: int,
+) -> Tuple[List[str], Dict[str, Any]]:
+    """
+    ffmpeg output arguments (for FrameEncoder(output_spec=...)) and the layout they produce.
+
+    width/height are the size after vf, i.e. of the main mp4.
+    """
+    seg_s = int(os.getenv("HLS_SEGMENT_SECONDS", "4"))
+    interval = max(1, int(os.getenv("SPRITE_INTERVAL_S", "2")))
+    thumb_w = _even(min(width, int(os.getenv("SPRITE_THUMB_WIDTH", "256"))))
+    thumb_h = _even(thumb_w * height / width)
+    n_thumbs = max(1, math.ceil(max(1, target_seconds) / interval))
+    columns = min(n_thumbs, max(1, int(os.getenv("SPRITE_COLUMNS", "5"))))
+    rows = math.ceil(n_thumbs / columns)
+
+    lower = rendition_heights(height)
+    variants = [{"name": f"{height}p", "width": width, "height": height}]
+    variants += [{"name": f"{h}p", "width": _even(width * h / height), "height": h} for h in lower]
+    for v in variants:
+        v["playlist"] = f"{v['name']}.m3u8"
+
+    # Segment boundaries need keyframes regardless of the profile's GOP
+    keyframes = ["-force_key_frames", f"expr:gte(t,n_forced*{seg_s})"]
+
+    def hls_opts(name: str) -> Dict[str, str]:
+        return {
+            "hls_time": str(seg_s),
+            "hls_playlist_type": "vod",
+            "hls_segment_filename": os.path.join(out_dir, f"{name}_%03d.ts"),
+        }
+
+    labels = ["main"] + [f"r{h}" for h in lower] + ["thumbs"]
+    graph = [f"[0:v]{vf},split={len(labels)}" + "".join(f"[{l}]" for l in labels)]
+    for v in variants[1:]:
+        graph.append(f"[r{v['height']}]scale={v['width']}:{v['height']}:flags=lanczos[v{v['height']}]")
+    graph.append(f"[thumbs]fps=1/{interval},scale={thumb_w}:{thumb_h},tile={columns}x{rows}[sprite]")
+
+    top = variants[0]
+    mp4_slave = "[f=mp4:movflags=+faststart]" if faststart else "[f=mp4]"
+    hls_slave = "[f=hls:" + ":".join(f"{k}={v}" for k, v in hls_opts(top["name"]).items()) + "]"
+    spec = [
+        "-filter_complex", ";".join(graph),
+        # one encode of the main stream, muxed twice: progressive mp4 + top HLS variant
+        "-map", "[main]", *codec, *keyframes, "-an",
+        "-f", "tee", f"{mp4_slave}{mp4_path}|{hls_slave}{os.path.join(out_dir, top['playlist'])}",
+    ]
+    for v in variants[1:]:
+        spec += ["-map", f"[v{v['height']}]", *codec, *keyframes, "-an", "-f", "hls"]
+        for k, val in hls_opts(v["name"]).items():
+            spec += [f"-{k}", val]
+        spec.append(os.path.join(out_dir, v["playlist"]))
+    spec += ["-map", "[sprite]", "-frames:v", "1", "-update", "1", "-q:v", "3", os.path.join(out_dir, "sprite.jpg")]
+
+    layout = {
+        "master": "master.m3u8",
+        "segment_s": seg_s,
+        "variants": variants,
+        "sprite": {
+            "file": "sprite.jpg",
+            "vtt": "sprite.vtt",
+            "interval_s": interval,
+            "columns": columns,
+            "rows": rows,
+            "thumb_width": thumb_w,
+            "thumb_height": thumb_h,
+        },
+    }
+    return spec, layout
+
+
+def _variant_bandwidth(out_dir: str, playlist: str) -> Tuple[int, int]:
+    """(peak, average) bits per second over the variant's segments."""
+    peak = 0.0
+    total_bits = 0.0
+    total_s = 0.0
+    duration = None
+    with open(os.path.join(out_dir, playlist), "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line.startswith("#EXTINF:"):
+                duration = float(line[len("#EXTINF:"):].split(",")[0])
+            elif line and not line.startswith("#") and duration:
+                bits = os.path.getsize(os.path.join(out_dir, line)) * 8
+                peak = max(peak, bits / duration)
+                total_bits += bits
+                total_s += duration
+                duration = None
+    return int(peak), int(total_bits / total_s) if total_s else 0
+
+
+def _vtt_time(t: float) -> str:
+    ms = int(round(t * 1000))
+    return f"{ms // 3600000:02d}:{ms // 60000 % 60:02d}:{ms // 1000 % 60:02d}.{ms % 1000:03d}"
+
+
+def finalize(out_dir: str, layout: Dict[str, Any], duration_s: float) -> Dict[str, Any]:
+    """Write master.m3u8 + sprite.vtt once ffmpeg has exited. Returns the manifest entry."""
+    lines = ["#EXTM3U", "#EXT-X-VERSION:3"]
+    for v in layout["variants"]:
+        v["bandwidth"], v["average_bandwidth"] = _variant_bandwidth(out_dir, v["playlist"])
+        lines.append(
+            f"#EXT-X-STREAM-INF:BANDWIDTH={v['bandwidth']},AVERAGE-BANDWIDTH={v['average_bandwidth']},"
+            f"RESOLUTION={v['width']}x{v['height']}"
+        )
+        lines.append(v["playlist"])
+    with open(os.path.join(out_dir, layout["master"]), "w", encoding="utf-8") as f:
+        f.write("\n".join(lines) + "\n")
+
+    sp = layout["sprite"]
+    cues = ["WEBVTT", ""]
+    count = min(sp["columns"] * sp["rows"], max(1, math.ceil(duration_s / sp["interval_s"])))
+    for n in range(count):
+        start = n * sp["interval_s"]
+        end = min(duration_s, start + sp["interval_s"]) if duration_s else start + sp["interval_s"]
+        x = (n % sp["columns"]) * sp["thumb_width"]
+        y = (n // sp["columns"]) * sp["thumb_height"]
+        cues.append(f"{_vtt_time(start)} --> {_vtt_time(end)}")
+        cues.append(f"{sp['file']}#xywh={x},{y},{sp['thumb_width']},{sp['thumb_height']}")
+        cues.append("")
+    with open(os.path.join(out_dir, sp["vtt"]), "w", encoding="utf-8") as f:
+        f.write("\n".join(cues))
+
+    return layout
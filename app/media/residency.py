@@ -0,0 +1,177 @@
+import gc
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+import torch
+
+
+def target_device() -> str:
+    device = os.getenv("DEVICE", "cuda")
+    return device if (device == "cuda" and torch.cuda.is_available()) else "cpu"
+
+
+def _module_bytes(module: Any) -> int:
+    if not isinstance(module, torch.nn.Module):
+        return 0
+    total = 0
+    for t in list(module.parameters()) + list(module.buffers()):
+        total += t.numel() * t.element_size()
+    return total
+
+
+def _components(pipe: Any) -> Dict[str, torch.nn.Module]:
+    comps = getattr(pipe, "components", None) or {}
+    return {k: v for k, v in comps.items() if isinstance(v, torch.nn.Module)}
+
+
+def _module_device(module: torch.nn.Module) -> Optional[str]:
+    for p in module.parameters():
+        return p.device.type
+    return None
+
+
+class PipelineResidency:
+    """
+    Keeps diffusion pipelines (SDXL, LTX, ...) resident within a memory budget.
+
+    - acquire(name) returns a ready-to-run pipeline, loading it (or moving it back to the device)
+      on demand. Other pipelines are freed least-recently-used first until the new one fits.
+    - On CUDA, freeing offloads individual components to host RAM (largest first), which makes
+      switching back cheap. On CPU (or with ENABLE_CPU_OFFLOAD hooks) the whole pipeline is dropped.
+    - Components shared by identity between pipelines are counted once and never freed while
+      another resident pipeline still uses them.
+    - PIPELINE_MEMORY_BUDGET_GB=0 (default) means unlimited, i.e. the previous keep-everything behaviour.
+    """
+
+    def __init__(self, budget_bytes: Optional[int] = None):
+        if budget_bytes is None:
+            budget_bytes = int(float(os.getenv("PIPELINE_MEMORY_BUDGET_GB", "0")) * (1024 ** 3))
+        self.budget_bytes = budget_bytes
+        self.device = target_device()
+        self._loaders: Dict[str, Callable[[], Any]] = {}
+        self._movable: Dict[str, bool] = {}
+        self._pipes: Dict[str, Any] = {}
+        self._last_used: Dict[str, float] = {}
+        self._known_bytes: Dict[str, int] = {}
+        self._metrics: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.RLock()
+
+    def register(self, name: str, loader: Callable[[], Any], movable: bool = True) -> None:
+        """movable=False for pipelines managed by accelerate hooks (enable_model_cpu_offload)."""
+        with self._lock:
+            self._loaders[name] = loader
+            self._movable[name] = movable
+            self._metrics.setdefault(name, {
+                "loads": 0, "load_s": 0.0, "evictions": 0, "offloads": 0, "restores": 0,
+            })
+
+    def is_loaded(self, name: str) -> bool:
+        """True if the pipeline is ready on the device without any load or transfer."""
+        with self._lock:
+            pipe = self._pipes.get(name)
+            return pipe is not None and self._offloaded_bytes(name) == 0
+
+    def acquire(self, name: str) -> Any:
+        with self._lock:
+            if name not in self._loaders:
+                raise KeyError(f"unknown pipeline: {name}")
+
+            pipe = self._pipes.get(name)
+            if pipe is not None:
+                if self._offloaded_bytes(name):
+                    self._make_room(name, self._offloaded_bytes(name))
+                    pipe.to(self.device)
+                    self._metrics[name]["restores"] += 1
+                self._last_used[name] = time.time()
+                return pipe
+
+            # Unknown size on first load: be pessimistic and free everything else
+            self._make_room(name, self._known_bytes.get(name, self.budget_bytes))
+            start = time.time()
+            pipe = self._loaders[name]()
+            m = self._metrics[name]
+            m["loads"] += 1
+            m["load_s"] = round(m["load_s"] + time.time() - start, 2)
+            self._pipes[name] = pipe
+            self._known_bytes[name] = sum(_module_bytes(c) for c in _components(pipe).values())
+            self._last_used[name] = time.time()
+            return pipe
+
+    def evict(self, name: str) -> None:
+        with self._lock:
+            pipe = self._pipes.pop(name, None)
+            self._last_used.pop(name, None)
+            if pipe is None:
+                return
+            self._metrics[name]["evictions"] += 1
+            del pipe
+            gc.collect()
+            if self.device == "cuda":
+                torch.cuda.empty_cache()
+
+    def resident_bytes(self) -> int:
+        """Bytes of unique components currently on the device."""
+        seen = set()
+        total = 0
+        for pipe in self._pipes.values():
+            for comp in _components(pipe).values():
+                if id(comp) in seen or _module_device(comp) != self.device:
+                    continue
+                seen.add(id(comp))
+                total += _module_bytes(comp)
+        return total
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            out = {}
+            for name, m in self._metrics.items():
+                out[name] = dict(m, resident=self.is_loaded(name), bytes=self._known_bytes.get(name))
+            return {"budget_bytes": self.budget_bytes, "resident_bytes": self.resident_bytes(), "pipelines": out}
+
+    # ----------------- internals -----------------
+    def _offloaded_bytes(self, name: str) -> int:
+        if self.device != "cuda" or not self._movable.get(name, True):
+            return 0
+        return sum(_module_bytes(c) for c in _components(self._pipes[name]).values() if _module_device(c) == "cpu")
+
+    def _shared_ids(self, keep: str) -> set:
+        return {id(c) for c in _components(self._pipes[keep]).values()} if keep in self._pipes else set()
+
+    def _make_room(self, keep: str, needed: int) -> None:
+        if self.budget_bytes <= 0:
+            return
+        victims: List[str] = sorted((n for n in self._pipes if n != keep), key=lambda n: self._last_used.get(n, 0))
+        for victim in victims:
+            if self.resident_bytes() + needed <= self.budget_bytes:
+                return
+            if self.device == "cuda" and self._movable.get(victim, True):
+                self._offload_components(victim, keep, needed)
+            else:
+                self.evict(victim)
+
+    def _offload_components(self, victim: str, keep: str, needed: int) -> None:
+        shared = self._shared_ids(keep)
+        comps = sorted(_components(self._pipes[victim]).values(), key=_module_bytes, reverse=True)
+        moved = False
+        for comp in comps:
+            if self.resident_bytes() + needed <= self.budget_bytes:
+                break
+            if id(comp) in shared or _module_device(comp) != self.device:
+                continue
+            comp.to("cpu")
+            moved = True
+        if moved:
+            self._metrics[victim]["offloads"] += 1
+            torch.cuda.empty_cache()
+
+
+_residency: Optional[PipelineResidency] = None
+
+
+def get_residency() -> PipelineResidency:
+    global _residency
+    if _residency is None:
+        _residency = PipelineResidency()
+    return _residency
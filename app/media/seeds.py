@@ -0,0 +1,13 @@
+import hashlib
+from typing import Any
+
+
+def derive_seed(*parts: Any) -> int:
+    """
+    Deterministic 31-bit seed from arbitrary parts (recipe id, section, index, prompt, ...).
+
+    Uses sha256 rather than hash(), which is salted per process (PYTHONHASHSEED), so the same
+    inputs give the same seed on every worker and across restarts.
+    """
+    blob = "\x1f".join("" if p is None else str(p) for p in parts).encode("utf-8")
+    return int.from_bytes(hashlib.sha256(blob).digest()[:8], "big") % (2**31)
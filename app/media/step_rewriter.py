@@ -1,7 +1,13 @@
 import os
-from typing import List
-from app.media.llm_client import ollama_generate
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+from pydantic import ValidationError
+
+from app.media.llm_client import get_client
 from app.media.json_utils import extract_json_object
+from app.media.llm_schemas import RewrittenStep, rewrite_schema
 
 SYSTEM = """You rewrite recipe steps to be clearer for cooking storyboards.
 Rules:
@@ -15,21 +21,40 @@ Return STRICT JSON only: {"rewritten_steps": [{"i": int, "text": str}, ...]}
 def _chunk(items: List[str], size: int) -> List[List[str]]:
     return [items[i:i+size] for i in range(0, len(items), size)]
 
-def rewrite_steps(ingredients: List[str], steps: List[str]) -> List[str]:
-    if not steps:
-        return []
+def _parse_items(text: str, wanted: List[int]) -> Dict[int, str]:
+    """Every well-formed {i, text} item for a wanted index; malformed items are skipped, not fatal."""
+    data = extract_json_object(text)
+    items = data.get("rewritten_steps") if isinstance(data, dict) else data
+    out: Dict[int, str] = {}
+    for raw in items if isinstance(items, list) else []:
+        try:
+            item = RewrittenStep.model_validate(raw)
+        except ValidationError:
+            continue
+        t = item.text.strip()
+        if item.i in wanted and t:
+            out[item.i] = t
+    return out
 
-    batch_size = int(os.getenv("LLM_BATCH_STEPS", "20"))
-    out = [None] * len(steps)
 
-    # If Ollama isn't configured, return original steps
-    if not os.getenv("OLLAMA_URL"):
-        return steps
-
-    for chunk_start, chunk_steps in enumerate(_chunk(steps, batch_size)):
-        idx0 = chunk_start * batch_size
-        indexed = [{"i": idx0 + j, "text": s} for j, s in enumerate(chunk_steps)]
+def _rewrite_chunk(ingredients: List[str], steps: List[str], indices: List[int]) -> Tuple[Dict[int, str], Dict[str, Any]]:
+    """
+    Rewrite one chunk. Items that parsed are kept; only the missing indices are asked for again
+    (LLM_CHUNK_RETRIES times). Returns ({i: text}, timing stats).
+    """
+    retries = int(os.getenv("LLM_CHUNK_RETRIES", "1"))
+    client = get_client()
+    done: Dict[int, str] = {}
+    start = time.time()
+    attempts = 0
+    error = None
 
+    while attempts <= retries:
+        wanted = [i for i in indices if i not in done]
+        if not wanted:
+            break
+        attempts += 1
+        indexed = [{"i": i, "text": steps[i]} for i in wanted]
         prompt = f"""Ingredients (context only):
 {ingredients}
 
@@ -38,21 +63,67 @@ Rewrite the following steps:
 {indexed}
 
 Return strict JSON only."""
-
         try:
-            resp = ollama_generate(SYSTEM, prompt, timeout_s=240)
-            data = extract_json_object(resp)
-            if not isinstance(data, dict) or "rewritten_steps" not in data:
-                continue
-
-            for item in data["rewritten_steps"]:
-                i = int(item.get("i"))
-                t = str(item.get("text") or "").strip()
-                if 0 <= i < len(out) and t:
-                    out[i] = t
-        except Exception:
-            # On failure, keep originals for this chunk
-            pass
+            text = client.generate(
+                SYSTEM, prompt, timeout_s=240, stop_at_json=True,
+                format=rewrite_schema(wanted),
+                accept=lambda t, w=wanted: len(_parse_items(t, w)) == len(w),
+            )
+            done.update(_parse_items(text, wanted))
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+
+    stats = {
+        "indices": [indices[0], indices[-1]],
+        "attempts": attempts,
+        "seconds": round(time.time() - start, 2),
+        "missing": [i for i in indices if i not in done],
+    }
+    if error:
+        stats["error"] = error[:300]
+    return done, stats
+
+
+def rewrite_steps_with_stats(
+    ingredients: List[str],
+    steps: List[str],
+    indices: Optional[List[int]] = None,
+) -> Tuple[List[str], Dict[str, Any]]:
+    """
+    Rewrite steps (all, or only `indices`) in LLM_BATCH_STEPS chunks, LLM_PARALLELISM chunks at a time.
 
+    Steps that could not be rewritten keep their original text. Stats carry per-chunk timing,
+    attempts and leftover indices (stored in the manifest as rewrite_stats).
+    """
+    if not steps:
+        return [], {}
+
+    # If Ollama isn't configured, return original steps
+    if not os.getenv("OLLAMA_URL"):
+        return steps, {}
+
+    batch_size = int(os.getenv("LLM_BATCH_STEPS", "20"))
+    parallelism = int(os.getenv("LLM_PARALLELISM", os.getenv("LLM_MAX_CONCURRENCY", "2")))
+    wanted = list(range(len(steps))) if indices is None else sorted(indices)
+    chunks = [wanted[i:i + batch_size] for i in range(0, len(wanted), batch_size)]
+
+    start = time.time()
+    with ThreadPoolExecutor(max_workers=max(1, min(parallelism, len(chunks)))) as pool:
+        results = list(pool.map(lambda idx: _rewrite_chunk(ingredients, steps, idx), chunks))
+
+    out: List[Optional[str]] = [None] * len(steps)
+    for done, _ in results:
+        for i, t in done.items():
+            out[i] = t
+
+    stats = {
+        "wall_s": round(time.time() - start, 2),
+        "parallelism": parallelism,
+        "chunks": [s for _, s in results],
+    }
     # Fill gaps with original text
-    return [out[i] if out[i] else steps[i] for i in range(len(steps))]
+    return [out[i] if out[i] else steps[i] for i in range(len(steps))], stats
+
+
+def rewrite_steps(ingredients: List[str], steps: List[str]) -> List[str]:
+    return rewrite_steps_with_stats(ingredients, steps)[0]
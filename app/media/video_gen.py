@@ -1,12 +1,18 @@
 import os
 import math
 import gc
+import shutil
+from typing import Optional
 import torch
 from PIL import Image
 from diffusers import LTXPipeline
-from diffusers.utils import export_to_video
 
-from app.media.ffmpeg import run
+from app.media.asset_cache import replacing
+from app.media.ffmpeg import FrameEncoder
+from app.media.encode_profiles import resolve_profile, codec_args, x264_args
+from app.media import renditions
+from app.media.residency import get_residency, target_device
+from app.media.seeds import derive_seed
 
 def _frames_for_seconds(seconds: int, fps: int) -> int:
     # LTX-Video tooling often expects (8 * k + 1) frames.
@@ -19,41 +25,52 @@ def _frames_for_seconds(seconds: int, fps: int) -> int:
 def _round_down_multiple(x: int, m: int) -> int:
     return max(m, x - (x % m))
 
-class VideoGen:
-    _pipe = None
+def _cpu_offload_enabled() -> bool:
+    return os.getenv("ENABLE_CPU_OFFLOAD", "false").lower() == "true" and target_device() == "cuda"
 
-    def __init__(self):
-        device = os.getenv("DEVICE", "cuda")
-        self.device = device if (device == "cuda" and torch.cuda.is_available()) else "cpu"
-        self.fps = int(os.getenv("VIDEO_FPS", "24"))
+def _load_ltx():
+    device = target_device()
+    model_id = os.getenv("VIDEO_MODEL", "Lightricks/LTX-Video")
 
-        if VideoGen._pipe is None:
-            model_id = os.getenv("VIDEO_MODEL", "Lightricks/LTX-Video")
+    if device == "cuda":
+        # Prefer bfloat16 if supported; otherwise float16
+        dtype = torch.bfloat16 if torch.cuda.is_bf16_supported() else torch.float16
+    else:
+        dtype = torch.float32
 
-            if self.device == "cuda":
-                # Prefer bfloat16 if supported; otherwise float16
-                dtype = torch.bfloat16 if torch.cuda.is_bf16_supported() else torch.float16
-            else:
-                dtype = torch.float32
+    pipe = LTXPipeline.from_pretrained(model_id, torch_dtype=dtype)
+    if _cpu_offload_enabled():
+        # trades speed for lower VRAM
+        pipe.enable_model_cpu_offload()
+    else:
+        pipe.to(device)
 
-            VideoGen._pipe = LTXPipeline.from_pretrained(model_id, torch_dtype=dtype)
-            if os.getenv("ENABLE_CPU_OFFLOAD", "false").lower() == "true" and self.device == "cuda":
-                # trades speed for lower VRAM
-                VideoGen._pipe.enable_model_cpu_offload()
-            else:
-                VideoGen._pipe.to(self.device)
+    pipe.set_progress_bar_config(disable=True)
+    return pipe
 
-            VideoGen._pipe.set_progress_bar_config(disable=True)
+# accelerate offload hooks own device placement, so the residency manager must not move it
+get_residency().register("video", _load_ltx, movable=not _cpu_offload_enabled())
 
-    def _generate_clip(self, prompt: str, negative_prompt: str, width: int, height: int, seconds: int, raw_mp4: str):
+class VideoGen:
+    def __init__(self):
+        # Cheap: the LTX pipeline is loaded on first use (or preloaded by app.worker.WarmWorker)
+        self.device = target_device()
+        self.fps = int(os.getenv("VIDEO_FPS", "24"))
+
+    @staticmethod
+    def load_pipeline():
+        # Residency is managed process-wide (memory budget, offload/evict) by app.media.residency
+        return get_residency().acquire("video")
+
+    def _generate_clip(self, prompt: str, negative_prompt: str, width: int, height: int, seconds: int, seed: int):
         num_frames = _frames_for_seconds(seconds, self.fps)
         steps = int(os.getenv("VIDEO_INFERENCE_STEPS", "40"))
         guidance = float(os.getenv("VIDEO_GUIDANCE", "5.0"))
 
-        g = torch.Generator(device="cuda" if self.device == "cuda" else "cpu").manual_seed(abs(hash(raw_mp4)) % (2**31))
+        g = torch.Generator(device="cuda" if self.device == "cuda" else "cpu").manual_seed(int(seed) % (2**31))
 
         with torch.inference_mode():
-            frames = VideoGen._pipe(
+            frames = VideoGen.load_pipeline()(
                 prompt=prompt,
                 negative_prompt=negative_prompt,
                 width=width,
@@ -64,16 +81,7 @@ class VideoGen:
                 generator=g,
             ).frames[0]
 
-        export_to_video(frames, raw_mp4, fps=self.fps)
-        # Return first frame for cover usage (as PIL)
-        cover = frames[0] if frames else None
-
-        # reduce memory pressure
-        del frames
-        gc.collect()
-        if self.device == "cuda":
-            torch.cuda.empty_cache()
-        return cover
+        return frames
 
     def generate_step_video(
         self,
@@ -83,7 +91,19 @@ class VideoGen:
         out_cover_png_path: str,
         target_seconds: int,
         work_dir: str,
-    ):
+        seed: Optional[int] = None,
+        encode_profile: Optional[str] = None,
+        renditions_dir: Optional[str] = None,
+    ) -> dict:
+        """
+        Generate, encode and write one step video + cover.
+
+        With renditions_dir (and VIDEO_RENDITIONS set) the same ffmpeg process also writes HLS
+        renditions + a thumbnail sprite there (see app.media.renditions).
+
+        Returns encode stats for the manifest: profile name, wall/cpu seconds, output bitrate and
+        the renditions layout (if any).
+        """
         base_w = int(os.getenv("VIDEO_BASE_WIDTH", "1216"))
         base_h = int(os.getenv("VIDEO_BASE_HEIGHT", "704"))
 
@@ -94,92 +114,132 @@ class VideoGen:
         segment_s_default = int(os.getenv("VIDEO_SEGMENT_SECONDS", "6"))
         upscale = os.getenv("VIDEO_UPSCALE_TO_1080P", "true").lower() == "true"
 
-        raw_parts = []
-        cover_saved = False
-        seconds_done = 0
+        if seed is None:
+            seed = derive_seed(out_mp4_path)
 
         # If planner didn't supply shots, generate a single generic shot
         if not shots:
             shots = [{"duration_s": min(segment_s_default, max(1, target_seconds)), "prompt": "Instructional cooking action in a clean kitchen."}]
 
-        for si, shot in enumerate(shots):
-            shot_prompt = str(shot.get("prompt") or "").strip()
-            shot_seconds = int(shot.get("duration_s") or segment_s_default)
-            shot_seconds = max(1, shot_seconds)
-
-            # If the step target is large, we can repeat segments of this shot prompt.
-            remaining = max(0, target_seconds - seconds_done)
-            shot_total = min(remaining if remaining else shot_seconds, shot_seconds)
-
-            # break into segments so the model stays in its comfort zone
-            segments = max(1, math.ceil(shot_total / segment_s_default))
-
-            for seg in range(segments):
-                seg_seconds = min(segment_s_default, shot_total - seg * segment_s_default)
-                if seg_seconds <= 0:
-                    continue
-
-                raw_mp4 = os.path.join(work_dir, f"shot{si}_seg{seg}_raw.mp4")
-                try:
-                    cover = self._generate_clip(
-                        prompt=shot_prompt,
-                        negative_prompt=negative_prompt,
-                        width=base_w,
-                        height=base_h,
-                        seconds=seg_seconds,
-                        raw_mp4=raw_mp4,
-                    )
-                except Exception:
-                    # fallback resolution if base fails
-                    raw_mp4 = os.path.join(work_dir, f"shot{si}_seg{seg}_raw_fallback.mp4")
-                    cover = self._generate_clip(
-                        prompt=shot_prompt,
-                        negative_prompt=negative_prompt,
-                        width=704,
-                        height=480,
-                        seconds=seg_seconds,
-                        raw_mp4=raw_mp4,
-                    )
-
-                if cover is not None and not cover_saved:
-                    # cover may be PIL.Image or array; ensure PIL
-                    if not isinstance(cover, Image.Image):
-                        cover = Image.fromarray(cover)
-                    cover.save(out_cover_png_path, format="PNG")
-                    cover_saved = True
-
-                raw_parts.append(raw_mp4)
-                seconds_done += seg_seconds
+        # One ffmpeg process for the whole step: raw frames in, scaled 1080p H.264 out, no audio.
+        # Written under a .partial name and renamed on success, so a crash never leaves a
+        # truncated {i}.mp4 that resume would mistake for a finished step.
+        vf = "scale=1920:1080:flags=lanczos" if upscale else "null"
+        partial_mp4 = os.path.splitext(out_mp4_path)[0] + ".partial.mp4"
+        profile_name, profile = resolve_profile(encode_profile)
+
+        out_w, out_h = (1920, 1080) if upscale else (base_w, base_h)
+
+        spec = layout = partial_dir = None
+        if renditions_dir and renditions.renditions_enabled():
+            partial_dir = renditions_dir + ".partial"
+            shutil.rmtree(partial_dir, ignore_errors=True)
+            os.makedirs(partial_dir)
+            spec, layout = renditions.build_output_spec(
+                partial_mp4, partial_dir, out_w, out_h, vf,
+                codec=codec_args(profile, self.fps), faststart=bool(profile.get("faststart")),
+                target_seconds=target_seconds,
+            )
+
+        encoder = FrameEncoder(
+            partial_mp4, base_w, base_h, self.fps,
+            vf=vf, output_args=x264_args(profile, self.fps), log_dir=work_dir, output_spec=spec,
+        )
+        try:
+            self._encode_shots(encoder, shots, negative_prompt, out_cover_png_path, target_seconds, base_w, base_h, seed)
+            if partial_dir:
+                layout = renditions.finalize(partial_dir, layout, encoder.stats["duration_s"])
+                # renditions first: a present {i}.mp4 is what marks the step as done on resume
+                shutil.rmtree(renditions_dir, ignore_errors=True)
+                os.replace(partial_dir, renditions_dir)
+        except Exception:
+            if partial_dir:
+                shutil.rmtree(partial_dir, ignore_errors=True)
+            raise
+
+        os.replace(partial_mp4, out_mp4_path)
+        stats = dict(encoder.stats, profile=profile_name)
+        if layout:
+            stats["renditions"] = layout
+        return stats
+
+    def _encode_shots(
+        self,
+        encoder: FrameEncoder,
+        shots: list[dict],
+        negative_prompt: str,
+        out_cover_png_path: str,
+        target_seconds: int,
+        base_w: int,
+        base_h: int,
+        seed: int,
+    ) -> None:
+        segment_s_default = int(os.getenv("VIDEO_SEGMENT_SECONDS", "6"))
+        cover_saved = False
+        seconds_done = 0
+
+        with encoder:
+            for si, shot in enumerate(shots):
+                shot_prompt = str(shot.get("prompt") or "").strip()
+                shot_seconds = int(shot.get("duration_s") or segment_s_default)
+                shot_seconds = max(1, shot_seconds)
+
+                # If the step target is large, we can repeat segments of this shot prompt.
+                remaining = max(0, target_seconds - seconds_done)
+                shot_total = min(remaining if remaining else shot_seconds, shot_seconds)
+
+                # break into segments so the model stays in its comfort zone
+                segments = max(1, math.ceil(shot_total / segment_s_default))
+
+                for seg in range(segments):
+                    seg_seconds = min(segment_s_default, shot_total - seg * segment_s_default)
+                    if seg_seconds <= 0:
+                        continue
+
+                    seg_seed = derive_seed(seed, si, seg)
+                    try:
+                        frames = self._generate_clip(
+                            prompt=shot_prompt,
+                            negative_prompt=negative_prompt,
+                            width=base_w,
+                            height=base_h,
+                            seconds=seg_seconds,
+                            seed=seg_seed,
+                        )
+                    except Exception:
+                        # fallback resolution if base fails (frames are upscaled to base size by the encoder)
+                        frames = self._generate_clip(
+                            prompt=shot_prompt,
+                            negative_prompt=negative_prompt,
+                            width=704,
+                            height=480,
+                            seconds=seg_seconds,
+                            seed=seg_seed,
+                        )
+
+                    # Stream straight into the single ffmpeg encode (no per-segment mp4)
+                    encoder.write_frames(frames)
+                    # First frame is used as the step cover
+                    cover = frames[0] if frames else None
+
+                    if cover is not None and not cover_saved:
+                        # cover may be PIL.Image or array; ensure PIL
+                        if not isinstance(cover, Image.Image):
+                            cover = Image.fromarray(cover)
+                        with replacing(out_cover_png_path) as tmp:
+                            cover.save(tmp, format="PNG")
+                        cover_saved = True
+
+                    # reduce memory pressure
+                    del frames, cover
+                    gc.collect()
+                    if self.device == "cuda":
+                        torch.cuda.empty_cache()
+
+                    seconds_done += seg_seconds
+
+                    if seconds_done >= target_seconds:
+                        break
 
                 if seconds_done >= target_seconds:
                     break
-
-            if seconds_done >= target_seconds:
-                break
-
-        # Concatenate parts (no re-encoding yet)
-        if len(raw_parts) == 1:
-            concat_in = raw_parts[0]
-        else:
-            concat_list = os.path.join(work_dir, "concat.txt")
-            with open(concat_list, "w", encoding="utf-8") as f:
-                for p in raw_parts:
-                    f.write(f"file '{p}'\n")
-            concat_in = os.path.join(work_dir, "concat_raw.mp4")
-            run(["ffmpeg", "-y", "-f", "concat", "-safe", "0", "-i", concat_list, "-c", "copy", concat_in])
-
-        # Final encode: 1080p, no audio
-        if upscale:
-            vf = "scale=1920:1080:flags=lanczos"
-        else:
-            vf = "null"
-
-        run([
-            "ffmpeg", "-y",
-            "-i", concat_in,
-            "-vf", vf,
-            "-c:v", "libx264",
-            "-pix_fmt", "yuv420p",
-            "-an",
-            out_mp4_path
-        ])
@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field
-from typing import List, Optional
+from typing import Dict, List, Optional
 
 
 class RecipeIn(BaseModel):
@@ -7,6 +7,8 @@ class RecipeIn(BaseModel):
     ingredients: List[str]
     # accept recipe_steps (preferred) and cooking_steps (legacy)
     recipe_steps: List[str] = Field(default_factory=list, alias="cooking_steps")
+    # ffmpeg encode profile for step videos (see app.media.encode_profiles); default: ENCODE_PROFILE
+    encode_profile: Optional[str] = None
 
     class Config:
         populate_by_name = True
@@ -15,6 +17,35 @@ class RecipeIn(BaseModel):
 class EnqueueResponse(BaseModel):
     job_id: str
     status_url: str
+    # True when an identical request was already in flight and its job is returned instead
+    coalesced: bool = False
+
+
+class BulkRecipesIn(BaseModel):
+    recipes: List[RecipeIn]
+    # "backfill" (default) or "interactive"; see app.queue.LANES
+    lane: str = "backfill"
+
+
+class BulkEnqueueResponse(BaseModel):
+    batch_id: str
+    lane: str
+    total: int
+    queued: int
+    coalesced: int
+    job_ids: List[str]
+    status_url: str
+
+
+class BatchStatus(BaseModel):
+    batch_id: str
+    lane: str
+    total: int
+    created_at: Optional[str] = None
+    counts: Dict[str, int]
+    done: int
+    progress: float
+    failed_job_ids: List[str] = Field(default_factory=list)
 
 
 class JobStatus(BaseModel):
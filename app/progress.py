@@ -1,8 +1,11 @@
+import fcntl
 import json
 import os
 import hashlib
+import time
+from contextlib import contextmanager
 from datetime import datetime, timezone
-from typing import Any, Dict, Optional
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
 
 
 def utcnow_iso() -> str:
@@ -19,6 +22,18 @@ def inputs_hash(payload: dict) -> str:
     return hashlib.sha256(blob).hexdigest()
 
 
+def _text_hash(text: Any) -> str:
+    return hashlib.sha256(str(text).encode("utf-8")).hexdigest()[:16]
+
+
+def item_hashes(payload: dict) -> Dict[str, List[str]]:
+    """Per-index content hashes, so a payload change can be narrowed down to the items it touches."""
+    return {
+        "ingredients": [_text_hash(x) for x in payload.get("ingredients") or []],
+        "steps": [_text_hash(x) for x in payload.get("recipe_steps") or payload.get("cooking_steps") or []],
+    }
+
+
 def recipe_root(base_dir: str, recipe_id: int) -> str:
     return os.path.join(base_dir, str(recipe_id))
 
@@ -36,8 +51,71 @@ def ensure_dirs(base_dir: str, recipe_id: int) -> Dict[str, str]:
     return {"root": root, "ingredients": ingredients_dir, "steps": steps_dir}
 
 
-def load_manifest(base_dir: str, recipe_id: int) -> Optional[Dict[str, Any]]:
-    path = manifest_path(base_dir, recipe_id)
+def events_path(base_dir: str, recipe_id: int) -> str:
+    return os.path.join(recipe_root(base_dir, recipe_id), "manifest.events.jsonl")
+
+
+# ----------------- Checkpointing -----------------
+# manifest.json is a snapshot; item updates in between are appended to manifest.events.jsonl
+# (one compact JSON line each). The log starts with a {"log_gen": N} header and only applies to
+# the snapshot with the same log_gen: compaction writes snapshot N+1 first and then replaces
+# the log, so a crash between the two leaves a log that is ignored instead of replayed twice.
+# Appends and compactions hold the manifest.json.lock flock.
+
+
+def _fsync_policy() -> str:
+    """MANIFEST_FSYNC=always (every event) | compact (snapshots only, default) | never."""
+    policy = os.getenv("MANIFEST_FSYNC", "compact").strip().lower()
+    return policy if policy in ("always", "compact", "never") else "compact"
+
+
+def _fsync_dir(path: str) -> None:
+    fd = os.open(os.path.dirname(path) or ".", os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _atomic_write(path: str, data: str, fsync: bool) -> None:
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(data)
+        if fsync:
+            f.flush()
+            os.fsync(f.fileno())
+    os.replace(tmp, path)
+    if fsync:
+        _fsync_dir(path)
+
+
+def _read_events(path: str) -> Tuple[Optional[int], List[Dict[str, Any]]]:
+    """(log_gen from the header, events). A torn last line (crash mid-append) is dropped."""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            lines = f.read().splitlines()
+    except FileNotFoundError:
+        return None, []
+    gen: Optional[int] = None
+    events: List[Dict[str, Any]] = []
+    for line in lines:
+        try:
+            rec = json.loads(line)
+        except ValueError:
+            continue
+        if gen is None and "log_gen" in rec:
+            gen = int(rec["log_gen"])
+        elif isinstance(rec, dict) and "s" in rec:
+            events.append(rec)
+    return gen, events
+
+
+def _log_gen(base_dir: str, recipe_id: int) -> int:
+    gen, _ = _read_events(events_path(base_dir, recipe_id))
+    return gen or 0
+
+
+def _read_snapshot(path: str) -> Optional[Dict[str, Any]]:
     if not os.path.exists(path):
         return None
     try:
@@ -47,34 +125,210 @@ def load_manifest(base_dir: str, recipe_id: int) -> Optional[Dict[str, Any]]:
         return None
 
 
-def save_manifest(base_dir: str, recipe_id: int, manifest: Dict[str, Any]) -> None:
+def manifest_stamp(base_dir: str, recipe_id: int) -> Optional[Tuple[int, ...]]:
+    """
+    Cheap change marker for what load_manifest would return: (inode, mtime_ns, size) of the
+    snapshot and of the event log. None if there is no manifest. Atomic replaces change the inode.
+    """
+    stamp: List[int] = []
+    for path in (manifest_path(base_dir, recipe_id), events_path(base_dir, recipe_id)):
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            if not stamp:
+                return None
+            stamp += [0, 0, 0]
+            continue
+        stamp += [st.st_ino, st.st_mtime_ns, st.st_size]
+    return tuple(stamp)
+
+
+def load_manifest(base_dir: str, recipe_id: int) -> Optional[Dict[str, Any]]:
+    """The manifest snapshot with the event log (if it belongs to this snapshot) replayed on top."""
     path = manifest_path(base_dir, recipe_id)
-    tmp = path + ".tmp"
-    with open(tmp, "w", encoding="utf-8") as f:
-        json.dump(manifest, f, ensure_ascii=False, indent=2, sort_keys=True)
-    os.replace(tmp, path)
+    for _ in range(3):
+        manifest = _read_snapshot(path)
+        if manifest is None:
+            return None
+        gen, events = _read_events(events_path(base_dir, recipe_id))
+        snapshot_gen = int(manifest.get("log_gen") or 0)
+        if gen is not None and gen > snapshot_gen:
+            # compacted between the two reads: the newer snapshot already has these events
+            continue
+        if gen == snapshot_gen:
+            for ev in events:
+                mark_item(manifest, ev["s"], ev["i"], **(ev.get("f") or {}))
+                manifest["updated_at"] = ev.get("t") or manifest.get("updated_at")
+        return manifest
+    return manifest
 
 
-def init_manifest(base_dir: str, payload: dict) -> Dict[str, Any]:
+@contextmanager
+def _manifest_lock(base_dir: str, recipe_id: int) -> Iterator[None]:
+    lock_path = manifest_path(base_dir, recipe_id) + ".lock"
+    with open(lock_path, "a") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def _compact(base_dir: str, recipe_id: int, manifest: Dict[str, Any]) -> None:
+    """Write `manifest` as snapshot N+1 and start an empty log for it. Caller holds the lock."""
+    fsync = _fsync_policy() != "never"
+    gen = max(int(manifest.get("log_gen") or 0), _log_gen(base_dir, recipe_id)) + 1
+    manifest["log_gen"] = gen
+    _atomic_write(
+        manifest_path(base_dir, recipe_id),
+        json.dumps(manifest, ensure_ascii=False, indent=2, sort_keys=True),
+        fsync,
+    )
+    _atomic_write(events_path(base_dir, recipe_id), json.dumps({"log_gen": gen}) + "\n", fsync)
+
+
+def save_manifest(base_dir: str, recipe_id: int, manifest: Dict[str, Any]) -> None:
+    """Write the whole manifest as a new snapshot; pending log events are superseded by it."""
+    with _manifest_lock(base_dir, recipe_id):
+        _compact(base_dir, recipe_id, manifest)
+
+
+def update_manifest(base_dir: str, recipe_id: int, fn: Callable[[Dict[str, Any]], None]) -> Dict[str, Any]:
+    """
+    Read-modify-write the manifest under an exclusive file lock.
+
+    Used when several workers write the same recipe (fan-out child jobs); a plain
+    load/save would let concurrent writers drop each other's item updates.
+    """
+    with _manifest_lock(base_dir, recipe_id):
+        manifest = load_manifest(base_dir, recipe_id)
+        if manifest is None:
+            raise RuntimeError(f"manifest missing or unreadable for recipe {recipe_id}")
+        fn(manifest)
+        _compact(base_dir, recipe_id, manifest)
+        return manifest
+
+
+def append_event(base_dir: str, recipe_id: int, section: str, idx: int, fields: Dict[str, Any]) -> int:
+    """Append one item update to the event log; returns the log size in bytes."""
+    line = json.dumps(
+        {"s": section, "i": int(idx), "f": fields, "t": utcnow_iso()},
+        ensure_ascii=False, separators=(",", ":"), default=str,
+    )
+    path = events_path(base_dir, recipe_id)
+    with _manifest_lock(base_dir, recipe_id):
+        with open(path, "a", encoding="utf-8") as f:
+            if f.tell() == 0:
+                # no log yet (first event after a snapshot written before event logs existed)
+                snapshot = _read_snapshot(manifest_path(base_dir, recipe_id)) or {}
+                f.write(json.dumps({"log_gen": int(snapshot.get("log_gen") or 0)}) + "\n")
+            f.write(line + "\n")
+            f.flush()
+            if _fsync_policy() == "always":
+                os.fsync(f.fileno())
+            return f.tell()
+
+
+class ManifestCheckpointer:
+    """
+    Item updates as appended log events, with a full snapshot only every MANIFEST_LOG_MAX_KB of
+    log or MANIFEST_COMPACT_INTERVAL_S seconds, and on flush().
+
+    With `manifest` (single writer, e.g. the serial job) updates are also applied to that dict
+    and compaction writes it as-is; without one (fan-out children) compaction re-reads the
+    manifest under the lock. Updates that change nothing are not logged.
+    """
+
+    def __init__(self, base_dir: str, recipe_id: int, manifest: Optional[Dict[str, Any]] = None):
+        self.base_dir = base_dir
+        self.recipe_id = recipe_id
+        self.manifest = manifest
+        self.max_bytes = int(os.getenv("MANIFEST_LOG_MAX_KB", "256")) * 1024
+        self.interval_s = float(os.getenv("MANIFEST_COMPACT_INTERVAL_S", "60"))
+        self.pending = 0
+        self._last_compact = time.monotonic()
+
+    def mark(self, section: str, idx: int, **fields: Any) -> bool:
+        """Record an item update; False if it changed nothing (and was not logged)."""
+        if self.manifest is not None:
+            item = (self.manifest.get(section) or {}).get(str(idx)) or {}
+            if all(k in item and item[k] == v for k, v in fields.items()):
+                return False
+            mark_item(self.manifest, section, idx, **fields)
+        size = append_event(self.base_dir, self.recipe_id, section, idx, fields)
+        self.pending += 1
+        if size >= self.max_bytes or time.monotonic() - self._last_compact >= self.interval_s:
+            self.flush()
+        return True
+
+    def flush(self) -> None:
+        if not self.pending:
+            return
+        if self.manifest is not None:
+            save_manifest(self.base_dir, self.recipe_id, self.manifest)
+        else:
+            update_manifest(self.base_dir, self.recipe_id, lambda m: None)
+        self.pending = 0
+        self._last_compact = time.monotonic()
+
+
+def reconcile_manifest(base_dir: str, payload: dict) -> Tuple[Dict[str, Any], Dict[str, List[int]]]:
+    """
+    Manifest for this payload plus the item indices whose cached state was dropped.
+
+    - Same inputs_hash: the stored manifest as-is.
+    - Changed payload, manifest with item_hashes: only items whose own text changed (or whose index
+      no longer exists) lose their status entry and cached rewrite; everything else - including
+      per-step plan entries, which are re-validated by plan_key - is kept. The caller must delete
+      the returned items' files, otherwise resume would treat the stale assets as done.
+    - No usable manifest (or one written before item_hashes existed): a fresh one.
+    """
     rid = int(payload["id"])
     h = inputs_hash(payload)
+    hashes = item_hashes(payload)
     now = utcnow_iso()
     m = load_manifest(base_dir, rid)
 
     if m and m.get("inputs_hash") == h:
+        m.setdefault("item_hashes", hashes)
         m["updated_at"] = now
-        return m
+        return m, {"ingredients": [], "steps": []}
+
+    if m and isinstance(m.get("item_hashes"), dict):
+        invalidated: Dict[str, List[int]] = {}
+        for section in ("ingredients", "steps"):
+            old, new = m["item_hashes"].get(section) or [], hashes[section]
+            changed = [i for i in range(max(len(old), len(new))) if i >= len(old) or i >= len(new) or old[i] != new[i]]
+            bucket = m.get(section) or {}
+            for i in changed:
+                bucket.pop(str(i), None)
+            m[section] = bucket
+            invalidated[section] = changed
+
+        rewritten = m.get("rewritten_steps")
+        if isinstance(rewritten, list):
+            stale = set(invalidated["steps"])
+            m["rewritten_steps"] = [
+                rewritten[i] if i < len(rewritten) and i not in stale else None for i in range(len(hashes["steps"]))
+            ]
+        m.update(inputs_hash=h, item_hashes=hashes, updated_at=now)
+        return m, invalidated
 
     return {
         "recipe_id": rid,
         "inputs_hash": h,
+        "item_hashes": hashes,   # section -> per-index content hash (see reconcile_manifest)
         "created_at": now,
         "updated_at": now,
         "ingredients": {},       # index -> {status, files, prompt, error}
         "steps": {},             # index -> {type, status, files, prompt/shots, error}
-        "rewritten_steps": None, # cached rewritten steps
+        "rewritten_steps": None, # cached rewritten steps (None entries = needs rewrite)
         "plan": None,            # cached plan from planner (ingredients+steps)
-    }
+    }, {"ingredients": [], "steps": []}
+
+
+def init_manifest(base_dir: str, payload: dict) -> Dict[str, Any]:
+    return reconcile_manifest(base_dir, payload)[0]
 
 
 def mark_item(manifest: Dict[str, Any], section: str, idx: int, **fields: Any) -> None:
@@ -1,16 +1,55 @@
+import hashlib
 import os
+import threading
+from typing import Dict, List, Optional
+
 import redis
 from rq import Queue
 
 
-def get_redis():
-    url = os.getenv("REDIS_URL", "redis://localhost:6379/0")
-    return redis.from_url(url)
+_client: Optional[redis.Redis] = None
+_client_pid: Optional[int] = None
+_client_lock = threading.Lock()
+
+
+def get_redis() -> redis.Redis:
+    """
+    Process-wide client on one shared connection pool (rebuilt after fork).
+
+    - REDIS_MAX_CONNECTIONS bounds the pool; when every connection is busy, callers wait up to
+      REDIS_POOL_TIMEOUT_S for one instead of failing (BlockingConnectionPool).
+    - REDIS_HEALTH_CHECK_INTERVAL_S pings connections idle for longer before reuse, so a
+      connection dropped by Redis or a proxy is replaced instead of failing the request.
+    """
+    global _client, _client_pid
+    if _client is None or _client_pid != os.getpid():
+        with _client_lock:
+            if _client is None or _client_pid != os.getpid():
+                pool = redis.BlockingConnectionPool.from_url(
+                    os.getenv("REDIS_URL", "redis://localhost:6379/0"),
+                    max_connections=int(os.getenv("REDIS_MAX_CONNECTIONS", "50")),
+                    timeout=float(os.getenv("REDIS_POOL_TIMEOUT_S", "20")),
+                    health_check_interval=int(os.getenv("REDIS_HEALTH_CHECK_INTERVAL_S", "30")),
+                    socket_keepalive=True,
+                )
+                _client = redis.Redis(connection_pool=pool)
+                _client_pid = os.getpid()
+    return _client
+
+
+# Asset generation lanes: editor-triggered requests vs. catalogue backfills. Workers listen on
+# both and drain them with weighted fairness (QUEUE_WEIGHTS, see app.worker.WarmWorker).
+INTERACTIVE_QUEUE = "recipe-assets"
+BACKFILL_QUEUE = os.getenv("ASSETS_BACKFILL_QUEUE", "recipe-assets-backfill")
+LANES = {"interactive": INTERACTIVE_QUEUE, "backfill": BACKFILL_QUEUE}
+
+# RQ statuses of a job that will still run (or is running)
+ACTIVE_JOB_STATUSES = ("queued", "started", "deferred", "scheduled")
 
 
-def get_queue() -> Queue:
-    # existing queue for asset generation
-    return Queue("recipe-assets", connection=get_redis())
+def get_queue(name: Optional[str] = None) -> Queue:
+    # existing queue for asset generation (interactive lane) unless another lane is named
+    return Queue(name or INTERACTIVE_QUEUE, connection=get_redis())
 
 
 def get_category_queue() -> Queue:
@@ -33,3 +72,181 @@ def claim_category_recipe(recipe_id: int) -> bool:
 
 def clear_category_claim(recipe_id: int) -> None:
     get_redis().delete(_claim_key(recipe_id))
+
+
+def claim_category_recipes(recipe_ids: List[int]) -> List[int]:
+    """Batch claim_category_recipe in one pipelined round-trip; returns the ids claimed."""
+    ids = [int(rid) for rid in recipe_ids]
+    if not ids:
+        return []
+    pipe = get_redis().pipeline(transaction=False)
+    for rid in ids:
+        pipe.set(_claim_key(rid), "1", nx=True, ex=_claim_ttl_s())
+    return [rid for rid, ok in zip(ids, pipe.execute()) if ok]
+
+
+def clear_category_claims(recipe_ids: List[int]) -> None:
+    if recipe_ids:
+        get_redis().delete(*[_claim_key(rid) for rid in recipe_ids])
+
+
+# ----------------- Recipe asset jobs -----------------
+def assets_job_id(payload: dict) -> str:
+    """
+    Deterministic job id for an asset request: recipe id + inputs_hash (+ encode_profile, which
+    changes the output). Identical POSTs map to the same job, so an in-flight one can be reused.
+    """
+    from app.progress import inputs_hash
+
+    key = inputs_hash(payload)
+    if payload.get("encode_profile"):
+        key = hashlib.sha256(f"{key}:{payload['encode_profile']}".encode("utf-8")).hexdigest()
+    return f"recipe-assets-{int(payload['id'])}-{key[:16]}"
+
+
+def claim_assets_enqueue(job_id: str) -> bool:
+    """Short guard so two concurrent identical POSTs don't both enqueue the same job id."""
+    return bool(get_redis().set(f"recipe-assets:enqueue:{job_id}", "1", nx=True, ex=30))
+
+
+def release_assets_enqueue(job_id: str) -> None:
+    get_redis().delete(f"recipe-assets:enqueue:{job_id}")
+
+
+def claim_assets_enqueue_many(job_ids: List[str]) -> List[bool]:
+    """claim_assets_enqueue for a whole batch in one round-trip."""
+    pipe = get_redis().pipeline(transaction=False)
+    for j in job_ids:
+        pipe.set(f"recipe-assets:enqueue:{j}", "1", nx=True, ex=30)
+    return [bool(ok) for ok in pipe.execute()] if job_ids else []
+
+
+def release_assets_enqueue_many(job_ids: List[str]) -> None:
+    if job_ids:
+        get_redis().delete(*[f"recipe-assets:enqueue:{j}" for j in job_ids])
+
+
+def _recipe_lock_key(recipe_id: int) -> str:
+    return f"recipe-assets:lock:{int(recipe_id)}"
+
+
+def recipe_lock_holder(recipe_id: int) -> Optional[str]:
+    raw = get_redis().get(_recipe_lock_key(recipe_id))
+    return raw.decode() if isinstance(raw, bytes) else raw
+
+
+def acquire_recipe_lock(recipe_id: int, holder: str, ttl_s: int) -> bool:
+    """Single writer per recipe directory: True if `holder` (a job id) now owns the lock."""
+    return bool(get_redis().set(_recipe_lock_key(recipe_id), holder, nx=True, ex=ttl_s))
+
+
+def _swap_recipe_lock(recipe_id: int, expected: str, holder: Optional[str], ttl_s: int = 0) -> bool:
+    """Compare-and-set on the lock value (WATCH/MULTI); holder=None deletes it."""
+    key = _recipe_lock_key(recipe_id)
+    with get_redis().pipeline() as pipe:
+        try:
+            pipe.watch(key)
+            current = pipe.get(key)
+            if (current.decode() if isinstance(current, bytes) else current) != expected:
+                pipe.unwatch()
+                return False
+            pipe.multi()
+            if holder is None:
+                pipe.delete(key)
+            else:
+                pipe.set(key, holder, ex=ttl_s)
+            pipe.execute()
+            return True
+        except redis.WatchError:
+            return False
+
+
+def refresh_recipe_lock(recipe_id: int, holder: str, ttl_s: int) -> bool:
+    return _swap_recipe_lock(recipe_id, holder, holder, ttl_s)
+
+
+def transfer_recipe_lock(recipe_id: int, holder: str, new_holder: str, ttl_s: int) -> bool:
+    """Hand the lock to another job (a fan-out finalizer, or a job taking over from a dead holder)."""
+    return _swap_recipe_lock(recipe_id, holder, new_holder, ttl_s)
+
+
+def release_recipe_lock(recipe_id: int, holder: str) -> bool:
+    return _swap_recipe_lock(recipe_id, holder, None)
+
+
+# ----------------- Batches -----------------
+# recipe-assets:batch:{id}       hash: lane, total, created_at
+# recipe-assets:batch:{id}:jobs  hash: original job id -> job currently doing that recipe's work
+#                                (follows deferrals and fan-out finalizers, see app.tasks)
+def _batch_ttl_s() -> int:
+    return int(os.getenv("ASSETS_BATCH_TTL_S", str(7 * 86400)))
+
+
+def batch_key(batch_id: str) -> str:
+    return f"recipe-assets:batch:{batch_id}"
+
+
+def record_batch(pipe, batch_id: str, lane: str, jobs: Dict[str, str], created_at: str) -> None:
+    """
+    Queue the batch bookkeeping on `pipe` (executed together with the enqueues). `jobs` maps each
+    recipe's job id to the job currently doing its work (itself unless coalesced into a follow-up).
+    """
+    key = batch_key(batch_id)
+    pipe.hset(key, mapping={"lane": lane, "total": len(jobs), "created_at": created_at})
+    if jobs:
+        pipe.hset(key + ":jobs", mapping=jobs)
+    pipe.expire(key, _batch_ttl_s())
+    pipe.expire(key + ":jobs", _batch_ttl_s())
+
+
+def batch_follow(batch_id: str, batch_job: str, job_id: str) -> None:
+    """The recipe tracked as `batch_job` continues in `job_id`."""
+    get_redis().hset(batch_key(batch_id) + ":jobs", batch_job, job_id)
+
+
+def job_statuses(connection, job_ids: List[str]) -> List[Optional[str]]:
+    """RQ status of many jobs in one round-trip (None for unknown/expired jobs)."""
+    pipe = connection.pipeline(transaction=False)
+    for j in job_ids:
+        pipe.hget(f"rq:job:{j}", "status")
+    return [s.decode() if isinstance(s, bytes) else s for s in pipe.execute()]
+
+
+# recipe-assets:next:{job id}  the job that continues its work (a deferral or fan-out finalizer)
+def _next_key(job_id: str) -> str:
+    return f"recipe-assets:next:{job_id}"
+
+
+def record_next_job(job_id: str, next_job_id: str) -> None:
+    # outlives the finished job's result (result_ttl) so the chain can always be followed
+    get_redis().set(_next_key(job_id), next_job_id, ex=_batch_ttl_s())
+
+
+def inflight_jobs(connection, job_ids: List[str], max_hops: int = 5) -> List[Optional[str]]:
+    """
+    For each job id, the job still working on its request (itself, or the deferral / finalizer a
+    finished job continued in), else None. One pipelined round-trip per hop for the whole list.
+    """
+    out: List[Optional[str]] = [None] * len(job_ids)
+    current = list(job_ids)
+    pending = list(range(len(job_ids)))
+    for _ in range(max_hops):
+        if not pending:
+            break
+        finished = []
+        for i, status in zip(pending, job_statuses(connection, [current[i] for i in pending])):
+            if status in ACTIVE_JOB_STATUSES:
+                out[i] = current[i]
+            elif status == "finished":
+                finished.append(i)
+        if not finished:
+            break
+        pipe = connection.pipeline(transaction=False)
+        for i in finished:
+            pipe.get(_next_key(current[i]))
+        pending = []
+        for i, nxt in zip(finished, pipe.execute()):
+            if nxt:
+                current[i] = nxt.decode() if isinstance(nxt, bytes) else nxt
+                pending.append(i)
+    return out
@@ -2,198 +2,381 @@ import os
 import shutil
 import tempfile
 import gc
+import threading
+import time
 import traceback
-from typing import Dict, Any, List
+import uuid
+from typing import Dict, Any, List, Optional, Tuple, Callable
 
-from app.media.step_rewriter import rewrite_steps
-from app.media.planner import plan_recipe_media
+from app.media.step_rewriter import rewrite_steps_with_stats
+from app.media.planner import plan_recipe_media, step_plan_key
+from app.media.ingredients import plan_ingredients
+from app.media.seeds import derive_seed
 from app.media.image_gen import ImageGen
 from app.media.video_gen import VideoGen
 from app.media.ffmpeg import run as ffmpeg_run
+from app.media.asset_cache import replacing
+from app.media.residency import get_residency
+from app.media.llm_client import get_client
 
-from app.progress import ensure_dirs, init_manifest, save_manifest, mark_item
+from app.progress import ensure_dirs, reconcile_manifest, load_manifest, save_manifest, update_manifest, mark_item
+from app.progress import ManifestCheckpointer
+from app import events as progress_events
+from app.queue import (
+    ACTIVE_JOB_STATUSES,
+    acquire_recipe_lock,
+    assets_job_id,
+    batch_follow,
+    record_next_job,
+    recipe_lock_holder,
+    refresh_recipe_lock,
+    release_recipe_lock,
+    transfer_recipe_lock,
+)
+
+
+# (section, index, image batch item, manifest fields written on success)
+ImageJob = Tuple[str, int, tuple, Dict[str, Any]]
+# mark(section, index, **fields) persists one manifest item update
+# (status "running" when an item starts, then "done" / "failed")
+MarkFn = Callable[..., None]
 
 
 def _exists(path: str) -> bool:
     return os.path.exists(path) and os.path.getsize(path) > 0
 
 
+def _format_tb(err: BaseException) -> str:
+    return "".join(traceback.format_exception(type(err), err, err.__traceback__))
+
+
 def _extract_cover_from_video(video_path: str, cover_path: str) -> None:
-    # Fast fallback: extract first frame as PNG (no SDXL re-run)
-    ffmpeg_run([
-        "ffmpeg", "-y",
-        "-i", video_path,
-        "-vf", "select=eq(n\,0)",
-        "-vframes", "1",
-        cover_path
-    ])
+    # Fast fallback: extract first frame as PNG (no SDXL re-run). Written beside and swapped in:
+    # an existing cover may be a hardlink of a shared cache entry.
+    with replacing(cover_path) as tmp:
+        ffmpeg_run([
+            "ffmpeg", "-y",
+            "-i", video_path,
+            "-vf", "select=eq(n\,0)",
+            "-vframes", "1",
+            tmp
+        ])
 
 
-def generate_assets_job(recipe: Dict[str, Any]) -> Dict[str, Any]:
-    """
-    Generate recipe assets.
+def _recipe_lists(recipe: Dict[str, Any]) -> Tuple[List[str], List[str]]:
+    ingredients: List[str] = recipe.get("ingredients", []) or []
+    steps: List[str] = recipe.get("recipe_steps") or recipe.get("cooking_steps") or []
+    return ingredients, steps
 
-    Resumability:
-    - Outputs are written deterministically to:
-      {ASSETS_BASE_DIR}/{id}/ingredients/{i}.png and {ASSETS_BASE_DIR}/{id}/steps/{i}.(png|mp4)
-    - A manifest.json is checkpointed frequently.
-    - If this job fails, simply POST the same payload again with the same id.
-      The worker will SKIP already generated files and continue from the first missing asset.
 
-    Notes:
-    - Resume is at the *asset level* (per ingredient / per step). A partially generated step video
-      is regenerated for that step if the final mp4 is missing.
+def _remove_item_assets(dirs: Dict[str, str], invalidated: Dict[str, List[int]]) -> None:
+    def _rm(path: str) -> None:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    for i in invalidated.get("ingredients") or []:
+        _rm(os.path.join(dirs["ingredients"], f"{i}.png"))
+    for i in invalidated.get("steps") or []:
+        for name in (f"{i}.png", f"{i}.mp4", f"{i}.partial.mp4"):
+            _rm(os.path.join(dirs["steps"], name))
+        shutil.rmtree(os.path.join(dirs["steps"], str(i)), ignore_errors=True)
+
+
+def _step_has_assets(dirs: Dict[str, str], i: int) -> bool:
+    # image steps and video covers both land at steps/{i}.png; resume skips a step once it exists
+    return _exists(os.path.join(dirs["steps"], f"{i}.png"))
+
+
+def _retry_heuristic(dirs: Dict[str, str], i: int, st: Any) -> bool:
+    """
+    A window that fell back to heuristics after an LLM failure is retried on the next run - but
+    only while the step has no assets yet; a finished step keeps its plan (no LLM call).
     """
+    return (
+        bool(os.getenv("OLLAMA_URL"))
+        and isinstance(st, dict)
+        and st.get("planned_by") == "heuristic"
+        and not _step_has_assets(dirs, i)
+    )
+
+
+def _plan_stale(plan: Dict[str, Any], steps: List[str], rewritten_steps: List[str], dirs: Dict[str, str]) -> bool:
+    planned = plan.get("steps") or []
+    if len(planned) != len(rewritten_steps):
+        return True
+    for i, st in enumerate(planned):
+        if _retry_heuristic(dirs, i, st):
+            return True
+        # entries without plan_key predate per-step planning and are kept
+        key = st.get("plan_key") if isinstance(st, dict) else None
+        if key and key != step_plan_key(steps[i] if i < len(steps) else "", rewritten_steps[i]):
+            return True
+    return False
+
+
+_PLAN_META = ("plan_key", "planned_by")
+
+
+def _replanned_steps(old: List[Any], new: List[Any]) -> List[int]:
+    """Indices whose plan entry changed (prompt, media_type, shots, ...) and so whose assets are stale."""
+    def content(st: Any) -> Any:
+        return {k: v for k, v in st.items() if k not in _PLAN_META} if isinstance(st, dict) else st
+
+    return [i for i in range(min(len(old), len(new))) if content(old[i]) != content(new[i])]
+
+
+def _prepare(recipe: Dict[str, Any]) -> Dict[str, Any]:
+    """Steps 1-2 of generation: rewrite + plan (both cached in the manifest)."""
     recipe_id = int(recipe["id"])
-    ingredients: List[str] = recipe.get("ingredients", []) or []
-    steps: List[str] = recipe.get("recipe_steps") or recipe.get("cooking_steps") or []
+    ingredients, steps = _recipe_lists(recipe)
 
     base_dir = os.getenv("ASSETS_BASE_DIR", "/data/assets")
     dirs = ensure_dirs(base_dir, recipe_id)
-    out_dir = dirs["root"]
-    ing_dir = dirs["ingredients"]
-    step_dir = dirs["steps"]
 
-    manifest = init_manifest(base_dir, recipe)
+    manifest, invalidated = reconcile_manifest(base_dir, recipe)
+    # Files first: a stale asset left on disk would be skipped as "done" on the next pass
+    _remove_item_assets(dirs, invalidated)
     save_manifest(base_dir, recipe_id, manifest)
 
-    # 1) Rewrite steps (cached in manifest)
+    # 1) Rewrite steps (cached in manifest; None entries were invalidated by a payload edit)
     rewritten_steps = manifest.get("rewritten_steps")
     if not isinstance(rewritten_steps, list) or len(rewritten_steps) != len(steps):
-        rewritten_steps = rewrite_steps(ingredients=ingredients, steps=steps)
+        rewritten_steps = [None] * len(steps)
+    missing = [i for i, t in enumerate(rewritten_steps) if not t]
+    if missing:
+        fresh, rewrite_stats = rewrite_steps_with_stats(ingredients=ingredients, steps=steps, indices=missing)
+        for i in missing:
+            rewritten_steps[i] = fresh[i]
         manifest["rewritten_steps"] = rewritten_steps
+        manifest["rewrite_stats"] = rewrite_stats
         save_manifest(base_dir, recipe_id, manifest)
 
     # 2) Plan media (cached in manifest)
     plan = manifest.get("plan")
-    if not isinstance(plan, dict) or len((plan.get("ingredients") or [])) != len(ingredients) or len((plan.get("steps") or [])) != len(rewritten_steps):
+    if not isinstance(plan, dict) or len((plan.get("ingredients") or [])) != len(ingredients) or _plan_stale(plan, steps, rewritten_steps, dirs):
+        # Steps whose plan_key still matches are reused; only new/edited steps (and heuristic
+        # fallbacks without assets) go to the LLM
+        old_steps = (plan or {}).get("steps") or []
+        cached_steps = {
+            st["plan_key"]: st
+            for i, st in enumerate(old_steps)
+            if isinstance(st, dict) and st.get("plan_key") and not _retry_heuristic(dirs, i, st)
+        }
         plan = plan_recipe_media(
             recipe_id=recipe_id,
             ingredients=ingredients,
             original_steps=steps,
-            rewritten_steps=rewritten_steps
+            rewritten_steps=rewritten_steps,
+            cached_steps=cached_steps,
         )
+        # A step whose plan changed must regenerate: files on disk are skipped as "done"
+        replanned = _replanned_steps(old_steps, plan["steps"])
+        if replanned:
+            _remove_item_assets(dirs, {"steps": replanned})
+            bucket = manifest.get("steps") or {}
+            for i in replanned:
+                bucket.pop(str(i), None)
+            manifest["steps"] = bucket
         manifest["plan"] = plan
         save_manifest(base_dir, recipe_id, manifest)
+    elif [x.get("key") for x in plan.get("ingredients") or []] != [x["key"] for x in plan_ingredients(ingredients)]:
+        # Ingredient entries are deterministic; refresh plans cached before canonical keys existed
+        plan["ingredients"] = plan_ingredients(ingredients)
+        save_manifest(base_dir, recipe_id, manifest)
 
-    img = ImageGen()
-    vid = VideoGen()
+    return {
+        "recipe_id": recipe_id,
+        "ingredients": ingredients,
+        "steps": steps,
+        "base_dir": base_dir,
+        "dirs": dirs,
+        "manifest": manifest,
+        "rewritten_steps": rewritten_steps,
+        "plan": plan,
+        "encode_profile": recipe.get("encode_profile"),
+    }
 
-    failures: List[Dict[str, Any]] = []
 
-    # 3) Generate ingredient images (skip existing)
-    for i, item in enumerate(plan.get("ingredients", [])):
-        out_abs = os.path.join(ing_dir, f"{i}.png")
-        out_rel = f"ingredients/{i}.png"
-        if _exists(out_abs):
-            mark_item(manifest, "ingredients", i, status="done", files=[out_rel], prompt=item.get("prompt"), text=ingredients[i] if i < len(ingredients) else None)
-            save_manifest(base_dir, recipe_id, manifest)
-            continue
+def _context_from_manifest(recipe: Dict[str, Any]) -> Dict[str, Any]:
+    """Context for a fan-out child: the parent already planned, so only read the manifest."""
+    recipe_id = int(recipe["id"])
+    ingredients, steps = _recipe_lists(recipe)
+    base_dir = os.getenv("ASSETS_BASE_DIR", "/data/assets")
+    manifest = load_manifest(base_dir, recipe_id)
+    if not manifest or not isinstance(manifest.get("plan"), dict):
+        raise RuntimeError(f"No planned manifest for recipe {recipe_id}; re-POST the recipe")
+    return {
+        "recipe_id": recipe_id,
+        "ingredients": ingredients,
+        "steps": steps,
+        "base_dir": base_dir,
+        "dirs": ensure_dirs(base_dir, recipe_id),
+        "manifest": manifest,
+        "rewritten_steps": manifest.get("rewritten_steps") or steps,
+        "plan": manifest["plan"],
+        "encode_profile": recipe.get("encode_profile"),
+    }
+
+
+def _media_type(st: Dict[str, Any]) -> str:
+    media_type = st.get("media_type")
+    return media_type if media_type in ("image", "video") else "image"
+
+
+def _step_text(ctx: Dict[str, Any], i: int) -> str:
+    rewritten_steps, steps = ctx["rewritten_steps"], ctx["steps"]
+    return rewritten_steps[i] if i < len(rewritten_steps) else (steps[i] if i < len(steps) else "")
+
+
+def _step_seed(ctx: Dict[str, Any], i: int, st: Dict[str, Any]) -> int:
+    # Stable across workers/restarts; recorded in the manifest so assets can be reproduced
+    return derive_seed(ctx["recipe_id"], "steps", i, st.get("prompt"))
+
+
+def _ingredient_job(ctx: Dict[str, Any], i: int) -> ImageJob:
+    item = ctx["plan"]["ingredients"][i]
+    ingredients = ctx["ingredients"]
+    out_abs = os.path.join(ctx["dirs"]["ingredients"], f"{i}.png")
+    fields = dict(
+        status="done",
+        files=[f"ingredients/{i}.png"],
+        key=item.get("key"),
+        prompt=item.get("prompt"),
+        negative_prompt=item.get("negative_prompt"),
+        seed=item.get("seed"),
+        text=ingredients[i] if i < len(ingredients) else None,
+    )
+    return ("ingredients", i, (item["prompt"], item.get("negative_prompt"), out_abs, item.get("seed")), fields)
+
+
+def _image_step_job(ctx: Dict[str, Any], i: int) -> ImageJob:
+    st = ctx["plan"]["steps"][i]
+    seed = _step_seed(ctx, i, st)
+    out_abs = os.path.join(ctx["dirs"]["steps"], f"{i}.png")
+    fields = dict(
+        type="image",
+        status="done",
+        files=[f"steps/{i}.png"],
+        prompt=st.get("prompt"),
+        negative_prompt=st.get("negative_prompt"),
+        seed=seed,
+        text=_step_text(ctx, i),
+    )
+    return ("steps", i, (st["prompt"], st.get("negative_prompt"), out_abs, seed), fields)
+
+
+def _run_image_jobs(img: ImageGen, jobs: List[ImageJob], mark: MarkFn, failures: List[Dict[str, Any]]) -> None:
+    def _settle(k: int, err: Optional[Exception]) -> None:
+        section, i, _, fields = jobs[k]
+        if err is None:
+            mark(section, i, **fields)
+            return
+        msg = f"{type(err).__name__}: {err}"
+        failed = dict(status="failed", error=msg, traceback=_format_tb(err), text=fields.get("text"))
+        if "type" in fields:
+            failed["type"] = fields["type"]
+        mark(section, i, **failed)
+        failures.append({"section": section, "index": i, "error": msg})
+
+    def _start(ks: List[int]) -> None:
+        for k in ks:
+            section, i, _, fields = jobs[k]
+            started = dict(status="running", type=fields["type"]) if "type" in fields else dict(status="running")
+            mark(section, i, **started)
+
+    if jobs:
+        img.generate_batch([job[2] for job in jobs], on_result=_settle, on_start=_start)
+        gc.collect()
+
+
+def _video_step_pending(ctx: Dict[str, Any], i: int) -> bool:
+    return not _exists(os.path.join(ctx["dirs"]["steps"], f"{i}.mp4"))
+
+
+def _run_video_step(ctx: Dict[str, Any], vid: Optional[VideoGen], i: int, mark: MarkFn, failures: List[Dict[str, Any]]) -> None:
+    """Generate (or resume) one video step. vid may be None when the mp4 already exists."""
+    st = ctx["plan"]["steps"][i]
+    step_dir = ctx["dirs"]["steps"]
+    step_text = _step_text(ctx, i)
+
+    cover_abs = os.path.join(step_dir, f"{i}.png")
+    cover_rel = f"steps/{i}.png"
+    video_abs = os.path.join(step_dir, f"{i}.mp4")
+    video_rel = f"steps/{i}.mp4"
+    # HLS renditions + thumbnail sprite (same encode pass), see app.media.renditions
+    renditions_abs = os.path.join(step_dir, str(i))
+    renditions_rel = f"steps/{i}"
+
+    # If video exists, ensure cover exists (extract from video if missing)
+    if _exists(video_abs) and _exists(cover_abs):
+        mark("steps", i, type="video", status="done", files=[video_rel, cover_rel], text=step_text)
+        return
+
+    if _exists(video_abs) and not _exists(cover_abs):
         try:
-            img.generate_png(
-                prompt=item["prompt"],
-                negative_prompt=item.get("negative_prompt"),
-                out_path=out_abs,
-            )
-            mark_item(manifest, "ingredients", i, status="done", files=[out_rel], prompt=item.get("prompt"), negative_prompt=item.get("negative_prompt"), text=ingredients[i] if i < len(ingredients) else None)
+            _extract_cover_from_video(video_abs, cover_abs)
+            mark("steps", i, type="video", status="done", files=[video_rel, cover_rel], text=step_text)
         except Exception as e:
             err = f"{type(e).__name__}: {e}"
-            mark_item(manifest, "ingredients", i, status="failed", error=err, traceback=traceback.format_exc(), text=ingredients[i] if i < len(ingredients) else None)
-            failures.append({"section": "ingredients", "index": i, "error": err})
+            mark("steps", i, type="video", status="failed", error=err, traceback=traceback.format_exc(), text=step_text)
+            failures.append({"section": "steps", "index": i, "error": err})
         finally:
-            save_manifest(base_dir, recipe_id, manifest)
             gc.collect()
+        return
 
-    # 4) Generate step media (skip existing)
-    for i, st in enumerate(plan.get("steps", [])):
-        media_type = st.get("media_type")
-        if media_type not in ("image", "video"):
-            media_type = "image"
-
-        step_text = rewritten_steps[i] if i < len(rewritten_steps) else (steps[i] if i < len(steps) else "")
-
-        if media_type == "image":
-            out_abs = os.path.join(step_dir, f"{i}.png")
-            out_rel = f"steps/{i}.png"
-
-            if _exists(out_abs):
-                mark_item(manifest, "steps", i, type="image", status="done", files=[out_rel], prompt=st.get("prompt"), text=step_text)
-                save_manifest(base_dir, recipe_id, manifest)
-                continue
+    mark("steps", i, type="video", status="running")
+    seed = _step_seed(ctx, i, st)
+    tmp = tempfile.mkdtemp(prefix=f"recipe_{ctx['recipe_id']}_step_{i}_")
+    try:
+        # Generate the video + cover using the video pipeline
+        encode = vid.generate_step_video(
+            shots=st.get("shots") or [],
+            negative_prompt=st.get("negative_prompt"),
+            out_mp4_path=video_abs,
+            out_cover_png_path=cover_abs,
+            target_seconds=int(st.get("target_seconds") or 12),
+            work_dir=tmp,
+            seed=seed,
+            encode_profile=ctx.get("encode_profile"),
+            renditions_dir=renditions_abs,
+        )
+        layout = encode.pop("renditions", None)
+        mark(
+            "steps", i,
+            type="video",
+            status="done",
+            files=[video_rel, cover_rel],
+            prompt=st.get("prompt"),
+            negative_prompt=st.get("negative_prompt"),
+            target_seconds=int(st.get("target_seconds") or 12),
+            shots=st.get("shots") or [],
+            seed=seed,
+            encode=encode,
+            renditions=dict(layout, dir=renditions_rel) if layout else None,
+            text=step_text,
+        )
+    except Exception as e:
+        err = f"{type(e).__name__}: {e}"
+        mark("steps", i, type="video", status="failed", error=err, traceback=traceback.format_exc(), text=step_text)
+        failures.append({"section": "steps", "index": i, "error": err})
+    finally:
+        keep = os.getenv("KEEP_INTERMEDIATE", "false").lower() == "true"
+        if not keep:
+            shutil.rmtree(tmp, ignore_errors=True)
+        gc.collect()
 
-            try:
-                img.generate_png(
-                    prompt=st["prompt"],
-                    negative_prompt=st.get("negative_prompt"),
-                    out_path=out_abs,
-                )
-                mark_item(manifest, "steps", i, type="image", status="done", files=[out_rel], prompt=st.get("prompt"), negative_prompt=st.get("negative_prompt"), text=step_text)
-            except Exception as e:
-                err = f"{type(e).__name__}: {e}"
-                mark_item(manifest, "steps", i, type="image", status="failed", error=err, traceback=traceback.format_exc(), text=step_text)
-                failures.append({"section": "steps", "index": i, "error": err})
-            finally:
-                save_manifest(base_dir, recipe_id, manifest)
-                gc.collect()
 
-        else:
-            cover_abs = os.path.join(step_dir, f"{i}.png")
-            cover_rel = f"steps/{i}.png"
-            video_abs = os.path.join(step_dir, f"{i}.mp4")
-            video_rel = f"steps/{i}.mp4"
-
-            # If video exists, ensure cover exists (extract from video if missing)
-            if _exists(video_abs) and _exists(cover_abs):
-                mark_item(manifest, "steps", i, type="video", status="done", files=[video_rel, cover_rel], text=step_text)
-                save_manifest(base_dir, recipe_id, manifest)
-                continue
+def _progress_mark(ckpt: ManifestCheckpointer, recipe_id: int) -> MarkFn:
+    """Checkpoint an item update and publish it as a progress event (skipped if nothing changed)."""
+    def mark(section: str, idx: int, **fields: Any) -> None:
+        if ckpt.mark(section, idx, **fields):
+            progress_events.item_event(recipe_id, section, idx, fields)
+    return mark
 
-            if _exists(video_abs) and not _exists(cover_abs):
-                try:
-                    _extract_cover_from_video(video_abs, cover_abs)
-                    mark_item(manifest, "steps", i, type="video", status="done", files=[video_rel, cover_rel], text=step_text)
-                except Exception as e:
-                    err = f"{type(e).__name__}: {e}"
-                    mark_item(manifest, "steps", i, type="video", status="failed", error=err, traceback=traceback.format_exc(), text=step_text)
-                    failures.append({"section": "steps", "index": i, "error": err})
-                finally:
-                    save_manifest(base_dir, recipe_id, manifest)
-                    gc.collect()
-                continue
-
-            tmp = tempfile.mkdtemp(prefix=f"recipe_{recipe_id}_step_{i}_")
-            try:
-                # Generate the video + cover using the video pipeline
-                vid.generate_step_video(
-                    shots=st.get("shots") or [],
-                    negative_prompt=st.get("negative_prompt"),
-                    out_mp4_path=video_abs,
-                    out_cover_png_path=cover_abs,
-                    target_seconds=int(st.get("target_seconds") or 12),
-                    work_dir=tmp,
-                )
-                mark_item(
-                    manifest, "steps", i,
-                    type="video",
-                    status="done",
-                    files=[video_rel, cover_rel],
-                    prompt=st.get("prompt"),
-                    negative_prompt=st.get("negative_prompt"),
-                    target_seconds=int(st.get("target_seconds") or 12),
-                    shots=st.get("shots") or [],
-                    text=step_text,
-                )
-            except Exception as e:
-                err = f"{type(e).__name__}: {e}"
-                mark_item(manifest, "steps", i, type="video", status="failed", error=err, traceback=traceback.format_exc(), text=step_text)
-                failures.append({"section": "steps", "index": i, "error": err})
-            finally:
-                keep = os.getenv("KEEP_INTERMEDIATE", "false").lower() == "true"
-                if not keep:
-                    shutil.rmtree(tmp, ignore_errors=True)
-                save_manifest(base_dir, recipe_id, manifest)
-                gc.collect()
 
+def _raise_failures(failures: List[Dict[str, Any]]) -> None:
     # Mark job failed if any failures, but keep partial outputs + manifest (resume friendly)
     if failures:
         raise RuntimeError(
@@ -201,11 +384,403 @@ def generate_assets_job(recipe: Dict[str, Any]) -> Dict[str, Any]:
             f"Failures (first 5): {failures[:5]}"
         )
 
+
+def _result(ctx: Dict[str, Any]) -> Dict[str, Any]:
+    rewritten_steps = ctx["rewritten_steps"]
     return {
         "ok": True,
-        "recipe_id": recipe_id,
-        "output_dir": out_dir,
-        "counts": {"ingredients": len(ingredients), "steps": len(steps)},
+        "recipe_id": ctx["recipe_id"],
+        "output_dir": ctx["dirs"]["root"],
+        "counts": {"ingredients": len(ctx["ingredients"]), "steps": len(ctx["steps"])},
         "rewritten_steps_preview": rewritten_steps[: min(5, len(rewritten_steps))],
-        "manifest": os.path.join(out_dir, "manifest.json"),
+        "manifest": os.path.join(ctx["dirs"]["root"], "manifest.json"),
+        "pipelines": get_residency().metrics(),
+        "llm": get_client().metrics(),
+    }
+
+
+def _schedule(ctx: Dict[str, Any]) -> List[Tuple[str, list]]:
+    """
+    Group pending work by pipeline so a job switches between SDXL and LTX at most once.
+
+    Returns [("image", [ImageJob, ...]), ("video", [step index, ...])] or the reverse order when
+    LTX is already resident and SDXL is not (e.g. a warm worker that just finished a video recipe).
+    Ingredient images and image steps share one SDXL group, so they also share micro-batches.
+    Only execution order changes: manifest keys and output paths stay index based.
+    """
+    step_plan = ctx["plan"].get("steps", [])
+    image_work: List[ImageJob] = [_ingredient_job(ctx, i) for i in range(len(ctx["plan"].get("ingredients", [])))]
+    image_work += [_image_step_job(ctx, i) for i, st in enumerate(step_plan) if _media_type(st) == "image"]
+    video_work = [i for i, st in enumerate(step_plan) if _media_type(st) == "video"]
+
+    residency = get_residency()
+    groups = [("image", image_work), ("video", video_work)]
+    if residency.is_loaded("video") and not residency.is_loaded("image"):
+        groups.reverse()
+    return groups
+
+
+def _fanout_enabled() -> bool:
+    return os.getenv("ASSETS_FANOUT", "false").lower() == "true"
+
+
+# ----------------- Per-recipe writer lock -----------------
+# One job at a time writes a recipe directory. The lock value is "<job id>:<execution token>", so
+# two executions of the same job id (a double enqueue) never mistake each other for themselves.
+# A holder whose job is no longer queued/running (crashed worker, cancelled finalizer) is taken over.
+
+
+def _current_job_id() -> Optional[str]:
+    from rq import get_current_job
+    job = get_current_job()
+    return job.id if job else None
+
+
+def _lane_queue():
+    """The queue (lane) the running job came from; follow-up jobs stay in the same lane."""
+    from rq import get_current_job
+    from app.queue import get_queue
+    job = get_current_job()
+    return get_queue(job.origin if job else None)
+
+
+def _batch_meta() -> Dict[str, Any]:
+    from rq import get_current_job
+    job = get_current_job()
+    meta = (job.meta or {}) if job else {}
+    return {k: meta[k] for k in ("batch_id", "batch_job") if k in meta}
+
+
+def _follow(meta: Dict[str, Any], job_id: str) -> None:
+    # The API (and bulk batches) track each recipe through deferrals and fan-out finalizers
+    current = _current_job_id()
+    if current:
+        record_next_job(current, job_id)
+    if meta:
+        batch_follow(meta["batch_id"], meta["batch_job"], job_id)
+
+
+def _lock_token(job_id: str) -> str:
+    return f"{job_id}:{uuid.uuid4().hex[:12]}"
+
+
+def _lock_job_id(holder: str) -> str:
+    # RQ job ids never contain ":"; older lock values are a bare job id
+    return holder.split(":", 1)[0]
+
+
+def _job_active(job_id: str) -> bool:
+    if job_id.startswith("local-"):
+        # not an RQ job (direct call); only its TTL can expire it
+        return True
+    from rq.exceptions import NoSuchJobError
+    from rq.job import Job
+    from app.queue import get_redis
+    try:
+        return Job.fetch(job_id, connection=get_redis()).get_status() in ACTIVE_JOB_STATUSES
+    except NoSuchJobError:
+        return False
+
+
+class RecipeWriter:
+    """
+    Holds recipe-assets:lock:{id} for the running job, refreshed by a heartbeat thread every
+    RECIPE_LOCK_TTL_S / 3 so a dead worker's lock expires on its own.
+    """
+
+    def __init__(self, recipe_id: int):
+        self.recipe_id = recipe_id
+        self.job_id = _current_job_id() or f"local-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self.holder = _lock_token(self.job_id)
+        self.ttl_s = int(os.getenv("RECIPE_LOCK_TTL_S", "300"))
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._owned = False
+
+    def acquire(self) -> Optional[str]:
+        """None once the lock is ours, else the lock value of the active execution holding it."""
+        attempts = 0
+        deadline = None
+        while True:
+            if acquire_recipe_lock(self.recipe_id, self.holder, self.ttl_s):
+                break
+            holder = recipe_lock_holder(self.recipe_id)
+            if holder is None:
+                continue  # expired in between
+            if _lock_job_id(holder) == self.job_id:
+                # Another execution of this very job id: either a live duplicate (its heartbeat
+                # keeps the lock) or a retry after its worker died (the lock runs out within
+                # ttl). Wait that long before deciding; never take over from it.
+                if deadline is None:
+                    deadline = time.monotonic() + self.ttl_s + 5
+                if time.monotonic() >= deadline:
+                    return holder
+                time.sleep(2.0)
+                continue
+            if _job_active(_lock_job_id(holder)):
+                return holder
+            if transfer_recipe_lock(self.recipe_id, holder, self.holder, self.ttl_s):
+                print(f"[recipe-lock] recipe {self.recipe_id}: took over from {holder}")
+                break
+            attempts += 1
+            if attempts >= 3:
+                return recipe_lock_holder(self.recipe_id) or "unknown"
+        self._owned = True
+        self._thread = threading.Thread(target=self._heartbeat, daemon=True)
+        self._thread.start()
+        return None
+
+    def _heartbeat(self) -> None:
+        while not self._stop.wait(max(1.0, self.ttl_s / 3)):
+            if not refresh_recipe_lock(self.recipe_id, self.holder, self.ttl_s):
+                print(f"[recipe-lock] recipe {self.recipe_id}: lock lost by {self.holder}")
+                return
+
+    def _stop_heartbeat(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def hand_off(self, new_holder: str, ttl_s: int) -> None:
+        """Pass the lock on (fan-out: to the already enqueued finalizer, which releases it)."""
+        self._stop_heartbeat()
+        if self._owned and transfer_recipe_lock(self.recipe_id, self.holder, new_holder, ttl_s):
+            self._owned = False
+
+    def release(self) -> None:
+        self._stop_heartbeat()
+        if self._owned:
+            release_recipe_lock(self.recipe_id, self.holder)
+            self._owned = False
+
+
+def _defer(recipe: Dict[str, Any], holder: str) -> Dict[str, Any]:
+    """Another job is writing this recipe: re-enqueue this request to run after it."""
+    from rq.job import Dependency
+
+    holder_job = _lock_job_id(holder)
+    if holder_job.startswith("local-") or not _current_job_id():
+        raise RuntimeError(f"recipe {recipe['id']} is being generated by {holder_job}; retry later")
+    if holder_job == _current_job_id():
+        # a duplicate execution of this job id: the live one does exactly this work
+        return {
+            "ok": True,
+            "recipe_id": int(recipe["id"]),
+            "duplicate_of": holder,
+        }
+    meta = _batch_meta()
+    job = _lane_queue().enqueue(
+        generate_assets_job,
+        recipe,
+        job_id=f"{assets_job_id(recipe)}-{uuid.uuid4().hex[:8]}",
+        depends_on=Dependency(jobs=[holder_job], allow_failure=True),
+        job_timeout=os.getenv("RQ_JOB_TIMEOUT", "48h"),
+        result_ttl=86400,
+        failure_ttl=86400,
+        meta=meta,
+    )
+    _follow(meta, job.id)
+    return {
+        "ok": True,
+        "recipe_id": int(recipe["id"]),
+        "deferred_job_id": job.id,
+        "waiting_for": holder_job,
+        "status_url": f"/v1/jobs/{job.id}",
     }
+
+
+def generate_assets_job(recipe: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Generate recipe assets.
+
+    Resumability:
+    - Outputs are written deterministically to:
+      {ASSETS_BASE_DIR}/{id}/ingredients/{i}.png and {ASSETS_BASE_DIR}/{id}/steps/{i}.(png|mp4)
+    - Every item update is checkpointed (appended to manifest.events.jsonl, compacted into manifest.json).
+    - If this job fails, simply POST the same payload again with the same id.
+      The worker will SKIP already generated files and continue from the first missing asset.
+
+    Notes:
+    - Resume is at the *asset level* (per ingredient / per step). A partially generated step video
+      is regenerated for that step if the final mp4 is missing.
+    - Work is grouped by pipeline (all SDXL items, then all LTX items, or the reverse if LTX is
+      already resident); SDXL items run in micro-batches (IMAGE_BATCH_SIZE) and the manifest is
+      still checkpointed per item.
+    - With ASSETS_FANOUT=true this job only plans, then enqueues one child job per missing asset
+      plus a finalizer (see _fan_out), so several workers can share one recipe.
+    - Only one job writes a recipe at a time (RecipeWriter). If another job holds the recipe,
+      this one is re-enqueued to run after it and returns {"deferred_job_id": ...}.
+    """
+    writer = RecipeWriter(int(recipe["id"]))
+    busy = writer.acquire()
+    if busy:
+        return _defer(recipe, busy)
+    try:
+        return _generate_locked(recipe, writer)
+    except Exception as e:
+        progress_events.job_finished(int(recipe["id"]), False, f"{type(e).__name__}: {e}")
+        raise
+    finally:
+        writer.release()
+
+
+def _generate_locked(recipe: Dict[str, Any], writer: RecipeWriter) -> Dict[str, Any]:
+    ctx = _prepare(recipe)
+    if _fanout_enabled():
+        return _fan_out(recipe, ctx, writer)
+
+    base_dir, recipe_id, manifest = ctx["base_dir"], ctx["recipe_id"], ctx["manifest"]
+
+    # Item updates go to the event log; the full manifest is rewritten only on compaction
+    ckpt = ManifestCheckpointer(base_dir, recipe_id, manifest)
+    mark = _progress_mark(ckpt, recipe_id)
+    progress_events.job_started(recipe_id, manifest, _current_job_id())
+
+    img = ImageGen()
+    vid = VideoGen()
+
+    failures: List[Dict[str, Any]] = []
+
+    # 3) Generate ingredient images + step media (skip existing), grouped by pipeline
+    try:
+        for pipeline, work in _schedule(ctx):
+            if pipeline == "image":
+                _run_image_jobs(img, work, mark, failures)
+            else:
+                for i in work:
+                    _run_video_step(ctx, vid, i, mark, failures)
+    finally:
+        ckpt.flush()
+
+    _raise_failures(failures)
+    progress_events.job_finished(recipe_id, True)
+    return _result(ctx)
+
+
+# ----------------- Fan-out mode -----------------
+def _fan_out(recipe: Dict[str, Any], ctx: Dict[str, Any], writer: RecipeWriter) -> Dict[str, Any]:
+    from rq import Queue
+    from rq.job import Dependency
+
+    base_dir, recipe_id, manifest = ctx["base_dir"], ctx["recipe_id"], ctx["manifest"]
+
+    # Already generated items are marked here; only missing ones get a child job.
+    # Children are enqueued pipeline-grouped (see _schedule) so workers swap models less often.
+    pending: List[Tuple[str, int]] = []
+    for pipeline, work in _schedule(ctx):
+        if pipeline == "image":
+            for section, idx, item, fields in work:
+                if _exists(item[2]):
+                    mark_item(manifest, section, idx, **fields)
+                else:
+                    pending.append((section, idx))
+        else:
+            for i in work:
+                if _video_step_pending(ctx, i):
+                    pending.append(("steps", i))
+                else:
+                    # cheap (at most a cover extraction); do it inline
+                    _run_video_step(ctx, None, i, lambda s, k, **f: mark_item(manifest, s, k, **f), [])
+    save_manifest(base_dir, recipe_id, manifest)
+    progress_events.job_started(recipe_id, manifest, _current_job_id())
+
+    q = _lane_queue()
+    item_timeout = os.getenv("RQ_ITEM_JOB_TIMEOUT", "6h")
+    # one Redis round-trip for all children
+    children = q.enqueue_many([
+        Queue.prepare_data(
+            "app.tasks.generate_asset_item_job",
+            (recipe, section, idx),
+            timeout=item_timeout,
+            result_ttl=86400,
+            failure_ttl=86400,
+        )
+        for section, idx in pending
+    ]) if pending else []
+    meta = _batch_meta()
+    # The finalizer inherits the recipe lock so no other job can start writing this recipe while
+    # the children run; it releases the lock when done. It is enqueued before the hand-off: a lock
+    # naming a job that doesn't exist yet would look stale and be taken over.
+    finalizer_id = f"{assets_job_id(recipe)}-finalize"
+    finalizer_lock = _lock_token(finalizer_id)
+    finalizer = q.enqueue(
+        "app.tasks.finalize_assets_job",
+        recipe,
+        job_id=finalizer_id,
+        depends_on=Dependency(jobs=children, allow_failure=True) if children else None,
+        job_timeout="10m",
+        result_ttl=86400,
+        failure_ttl=86400,
+        meta={**meta, "recipe_lock": finalizer_lock},
+    )
+    writer.hand_off(finalizer_lock, int(os.getenv("RECIPE_LOCK_FANOUT_TTL_S", "86400")))
+    _follow(meta, finalizer.id)
+    return {
+        "ok": True,
+        "fanout": True,
+        "recipe_id": recipe_id,
+        "child_jobs": [j.id for j in children],
+        "finalizer_job_id": finalizer.id,
+        "finalizer_status_url": f"/v1/jobs/{finalizer.id}",
+        "manifest": os.path.join(ctx["dirs"]["root"], "manifest.json"),
+    }
+
+
+def generate_asset_item_job(recipe: Dict[str, Any], section: str, index: int) -> Dict[str, Any]:
+    """RQ task (fan-out child): generate a single ingredient image, step image or step video."""
+    ctx = _context_from_manifest(recipe)
+    base_dir, recipe_id = ctx["base_dir"], ctx["recipe_id"]
+    i = int(index)
+
+    # Siblings run on other workers: append to the shared event log (under the manifest lock);
+    # the finalizer folds it into manifest.json
+    mark = _progress_mark(ManifestCheckpointer(base_dir, recipe_id), recipe_id)
+
+    failures: List[Dict[str, Any]] = []
+    if section == "ingredients":
+        _run_image_jobs(ImageGen(), [_ingredient_job(ctx, i)], mark, failures)
+    elif _media_type(ctx["plan"]["steps"][i]) == "image":
+        _run_image_jobs(ImageGen(), [_image_step_job(ctx, i)], mark, failures)
+    else:
+        _run_video_step(ctx, VideoGen() if _video_step_pending(ctx, i) else None, i, mark, failures)
+
+    _raise_failures(failures)
+    return {"ok": True, "recipe_id": recipe_id, "section": section, "index": i}
+
+
+def finalize_assets_job(recipe: Dict[str, Any]) -> Dict[str, Any]:
+    """RQ task (fan-out finalizer): runs once every child finished (or failed)."""
+    try:
+        return _finalize(recipe)
+    except Exception as e:
+        progress_events.job_finished(int(recipe["id"]), False, f"{type(e).__name__}: {e}")
+        raise
+    finally:
+        from rq import get_current_job
+        job = get_current_job()
+        holder = ((job.meta or {}).get("recipe_lock") or job.id) if job else None
+        if holder:
+            release_recipe_lock(int(recipe["id"]), holder)
+
+
+def _finalize(recipe: Dict[str, Any]) -> Dict[str, Any]:
+    ctx = _context_from_manifest(recipe)
+    # Compact the children's event log into the snapshot
+    manifest = update_manifest(ctx["base_dir"], ctx["recipe_id"], lambda m: None)
+    ctx["manifest"] = manifest
+
+    failures: List[Dict[str, Any]] = []
+    expected = {
+        "ingredients": len(ctx["plan"].get("ingredients", [])),
+        "steps": len(ctx["plan"].get("steps", [])),
+    }
+    for section, count in expected.items():
+        bucket = manifest.get(section) or {}
+        for i in range(count):
+            item = bucket.get(str(i)) or {}
+            if item.get("status") != "done":
+                failures.append({"section": section, "index": i, "error": item.get("error") or "not generated"})
+
+    _raise_failures(failures)
+    progress_events.job_finished(ctx["recipe_id"], True)
+    return _result(ctx)
@@ -0,0 +1,123 @@
+import json
+import os
+import time
+from typing import Dict, List
+
+from rq import SimpleWorker, Worker
+
+from app.progress import utcnow_iso
+from app.queue import BACKFILL_QUEUE, INTERACTIVE_QUEUE
+
+
+READY_KEY = "recipe-assets:workers:ready"
+
+
+def _preload_list() -> List[str]:
+    raw = os.getenv("PRELOAD_PIPELINES", "image,video")
+    return [p.strip().lower() for p in raw.split(",") if p.strip()]
+
+
+def preload_pipelines(names: List[str]) -> Dict[str, float]:
+    """Load the requested pipelines ("image" -> SDXL, "video" -> LTX). Returns load seconds per pipeline."""
+    timings: Dict[str, float] = {}
+    for name in names:
+        start = time.time()
+        if name == "image":
+            from app.media.image_gen import ImageGen
+            ImageGen.load_pipeline()
+        elif name == "video":
+            from app.media.video_gen import VideoGen
+            VideoGen.load_pipeline()
+        else:
+            print(f"[warm-worker] unknown pipeline in PRELOAD_PIPELINES: {name}")
+            continue
+        timings[name] = round(time.time() - start, 2)
+    return timings
+
+
+def _pipeline_metrics() -> dict:
+    from app.media.residency import get_residency
+    return get_residency().metrics()
+
+
+def queue_weights() -> Dict[str, int]:
+    """QUEUE_WEIGHTS="recipe-assets=4,recipe-assets-backfill=1" (the lane queues); unlisted queues weigh 1."""
+    out: Dict[str, int] = {}
+    for part in os.getenv("QUEUE_WEIGHTS", f"{INTERACTIVE_QUEUE}=4,{BACKFILL_QUEUE}=1").split(","):
+        name, _, weight = part.partition("=")
+        if name.strip() and weight.strip():
+            out[name.strip()] = max(1, int(weight))
+    return out
+
+
+class WarmWorker(SimpleWorker):
+    """
+    Asset worker that keeps models resident between jobs.
+
+    - Runs jobs in-process (SimpleWorker) instead of forking a work horse per job: a forked horse
+      would load SDXL/LTX again for every job and throw them away on exit, and CUDA state does
+      not survive fork anyway.
+    - Preloads PRELOAD_PIPELINES before taking the first job, then publishes readiness to Redis
+      (hash recipe-assets:workers:ready, field = worker name) so /health-check can report it.
+
+    - With several queues (lanes), they are drained with weighted fairness instead of strict
+      priority: after every job the queue order is rotated by smooth weighted round-robin over
+      QUEUE_WEIGHTS, so with 4:1 the backfill lane is tried first on one dequeue in five and a
+      large backfill can neither starve nor be starved by interactive requests.
+
+    Usage: rq worker -w app.worker.WarmWorker recipe-assets recipe-assets-backfill
+    """
+
+    def reorder_queues(self, reference_queue) -> None:
+        weights = queue_weights()
+        current = getattr(self, "_wrr_current", None)
+        if current is None:
+            current = self._wrr_current = {}
+        names = [q.name for q in self._ordered_queues]
+        for name in names:
+            current[name] = current.get(name, 0) + weights.get(name, 1)
+        first = max(names, key=lambda n: current[n])
+        current[first] -= sum(weights.get(n, 1) for n in names)
+        # BLPOP takes the first non-empty queue: `first` wins if it has work, else the heavier lanes
+        self._ordered_queues.sort(key=lambda q: (q.name != first, -weights.get(q.name, 1)))
+
+    def work(self, *args, **kwargs):
+        names = _preload_list()
+        print(f"[warm-worker] preloading pipelines: {names or 'none'}")
+        timings = preload_pipelines(names)
+        print(f"[warm-worker] ready. load_s={timings}")
+        self._publish_ready(timings)
+        try:
+            return super().work(*args, **kwargs)
+        finally:
+            try:
+                self.connection.hdel(READY_KEY, self.name)
+            except Exception:
+                pass
+
+    def _publish_ready(self, timings: Dict[str, float]) -> None:
+        try:
+            self.connection.hset(READY_KEY, self.name, json.dumps({
+                "pipelines": sorted(timings.keys()),
+                "load_s": timings,
+                "residency": _pipeline_metrics(),
+                "ready_at": utcnow_iso(),
+                "pid": os.getpid(),
+            }))
+        except Exception as e:
+            print(f"[warm-worker] could not publish readiness: {e}")
+
+
+def ready_workers(connection) -> Dict[str, dict]:
+    # Entries of workers that died without cleanup are ignored (RQ drops them from its registry)
+    live = {w.name for w in Worker.all(connection=connection)}
+    out = {}
+    for name, raw in (connection.hgetall(READY_KEY) or {}).items():
+        key = name.decode() if isinstance(name, bytes) else str(name)
+        if key not in live:
+            continue
+        try:
+            out[key] = json.loads(raw)
+        except Exception:
+            continue
+    return out
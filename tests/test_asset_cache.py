@@ -0,0 +1,43 @@
+import os
+
+from app.media.asset_cache import AssetCache, cache_key, replacing
+
+
+def _write(path, data):
+    with open(path, "wb") as f:
+        f.write(data)
+
+
+def _read(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def test_overwriting_stored_file_leaves_cache_entry_unchanged(tmp_path):
+    cache = AssetCache(base_dir=str(tmp_path), max_bytes=0)
+    key = cache_key(prompt="onion")
+    src = str(tmp_path / "0.png")
+    _write(src, b"original")
+    cache.store(key, src)
+
+    # e.g. a video cover written over steps/{i}.png that used to be an image step
+    _write(src, b"cover")
+
+    assert _read(cache.path_for(key)) == b"original"
+
+
+def test_replacing_a_fetched_file_leaves_cache_entry_unchanged(tmp_path):
+    cache = AssetCache(base_dir=str(tmp_path), max_bytes=0)
+    key = cache_key(prompt="onion")
+    src = str(tmp_path / "src.png")
+    _write(src, b"original")
+    cache.store(key, src)
+
+    dst = str(tmp_path / "1.png")
+    assert cache.fetch(key, dst)
+    with replacing(dst) as tmp:
+        _write(tmp, b"cover")
+
+    assert _read(dst) == b"cover"
+    assert _read(cache.path_for(key)) == b"original"
+    assert not [f for f in os.listdir(tmp_path) if ".tmp" in f]
@@ -0,0 +1,70 @@
+import os
+
+import pytest
+
+from app import tasks
+
+
+RECIPE = {
+    "id": 101,
+    "ingredients": ["2 eggs"],
+    "recipe_steps": ["Whisk the eggs.", "Fry the eggs in butter."],
+}
+
+
+@pytest.fixture
+def assets_dir(tmp_path, monkeypatch):
+    monkeypatch.setenv("ASSETS_BASE_DIR", str(tmp_path))
+    monkeypatch.delenv("OLLAMA_URL", raising=False)
+    return tmp_path
+
+
+def _heuristic_run(recipe):
+    # no OLLAMA_URL: rewrite keeps the originals and every window is planned by the heuristic
+    ctx = tasks._prepare(recipe)
+    assert all(st["planned_by"] == "heuristic" for st in ctx["plan"]["steps"])
+    return ctx
+
+
+def _touch(path):
+    with open(path, "wb") as f:
+        f.write(b"x")
+
+
+def test_done_recipe_makes_no_llm_call_on_repost(assets_dir, monkeypatch):
+    ctx = _heuristic_run(RECIPE)
+    for i in range(len(RECIPE["recipe_steps"])):
+        _touch(os.path.join(ctx["dirs"]["steps"], f"{i}.png"))
+
+    def no_llm(**kwargs):
+        raise AssertionError("re-POST of a finished recipe must not replan")
+
+    monkeypatch.setenv("OLLAMA_URL", "http://ollama:11434")
+    monkeypatch.setattr(tasks, "plan_recipe_media", no_llm)
+    again = tasks._prepare(RECIPE)
+    assert again["plan"] == ctx["plan"]
+
+
+def test_replanned_step_drops_its_stale_assets(assets_dir, monkeypatch):
+    ctx = _heuristic_run(RECIPE)
+    done = os.path.join(ctx["dirs"]["steps"], "0.png")
+    _touch(done)
+    old_plan = ctx["plan"]
+
+    def llm_plan(**kwargs):
+        # step 1 has no assets and is retried; the LLM answers differently for it
+        cached = kwargs["cached_steps"]
+        steps = [cached.get(st["plan_key"]) or dict(st, prompt="llm prompt", planned_by="llm") for st in old_plan["steps"]]
+        return dict(old_plan, steps=steps)
+
+    stale = os.path.join(ctx["dirs"]["steps"], "1.mp4")
+    _touch(stale)
+    monkeypatch.setenv("OLLAMA_URL", "http://ollama:11434")
+    monkeypatch.setattr(tasks, "rewrite_steps_with_stats", lambda **kw: (kw["steps"], {}))
+    monkeypatch.setattr(tasks, "plan_recipe_media", llm_plan)
+    again = tasks._prepare(RECIPE)
+
+    assert again["plan"]["steps"][0] == old_plan["steps"][0]
+    assert again["plan"]["steps"][1]["prompt"] == "llm prompt"
+    assert os.path.exists(done)
+    assert not os.path.exists(stale)